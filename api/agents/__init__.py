@@ -1,21 +1,86 @@
-from .router import RouterAgent
-from .stop_reparto_agent import StopRepartoAgent
-from .aviso_urgente_agent import AvisoUrgenteAgent
+from functools import lru_cache
+from importlib import import_module
+from typing import TYPE_CHECKING, Optional
 
-def create_router_agent():
-    return RouterAgent()
+if TYPE_CHECKING:
+    import httpx
 
-def create_stop_reparto_agent():
-    return StopRepartoAgent()
+# Exported names and the submodule defining them. Submodules are imported on
+# first access, so importing the package (or a light module such as
+# agents.cache) does not load httpx, the prompts and the policies up front.
+_EXPORTS = {
+    "GeminiAgent": ".gemini",
+    "SpecialistAgent": ".gemini",
+    "RouterAgent": ".router",
+    "StopRepartoAgent": ".stop_reparto_agent",
+    "AvisoUrgenteAgent": ".aviso_urgente_agent",
+    "FusedStopRepartoAgent": ".fused_agent",
+    "MOTIVOS": ".fused_agent",
+    "get_http_client": ".http_client",
+    "close_http_client": ".http_client",
+    "prewarm_connection": ".http_client",
+    "MicroBatcher": ".batcher",
+}
 
-def create_aviso_urgente_agent():
-    return AvisoUrgenteAgent()
+
+def __getattr__(name: str):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+# Agents are stateless apart from their caches, so one instance per model (and
+# injected HTTP client) is shared by every caller and keeps its context cache
+# warm. Without a client, agents use the shared pool from http_client.py
+@lru_cache(maxsize=8)
+def create_router_agent(
+    model_name: str = "gemini-2.0-flash-exp",
+    http_client: "Optional[httpx.AsyncClient]" = None
+):
+    from .router import RouterAgent
+    return RouterAgent(model_name, http_client)
+
+@lru_cache(maxsize=8)
+def create_stop_reparto_agent(
+    model_name: str = "gemini-2.0-flash-exp",
+    http_client: "Optional[httpx.AsyncClient]" = None
+):
+    from .stop_reparto_agent import StopRepartoAgent
+    return StopRepartoAgent(model_name, http_client)
+
+@lru_cache(maxsize=8)
+def create_aviso_urgente_agent(
+    model_name: str = "gemini-2.0-flash-exp",
+    http_client: "Optional[httpx.AsyncClient]" = None
+):
+    from .aviso_urgente_agent import AvisoUrgenteAgent
+    return AvisoUrgenteAgent(model_name, http_client)
+
+@lru_cache(maxsize=8)
+def create_fused_stop_reparto_agent(
+    model_name: str = "gemini-2.0-flash-exp",
+    http_client: "Optional[httpx.AsyncClient]" = None
+):
+    from .fused_agent import FusedStopRepartoAgent
+    return FusedStopRepartoAgent(model_name, http_client)
 
 __all__ = [
+    "GeminiAgent",
+    "SpecialistAgent",
     "RouterAgent",
     "create_router_agent",
     "StopRepartoAgent",
     "create_stop_reparto_agent",
     "AvisoUrgenteAgent",
-    "create_aviso_urgente_agent"
+    "create_aviso_urgente_agent",
+    "FusedStopRepartoAgent",
+    "create_fused_stop_reparto_agent",
+    "MOTIVOS",
+    "get_http_client",
+    "close_http_client",
+    "prewarm_connection",
+    "MicroBatcher"
 ]
@@ -4,45 +4,36 @@ Specialist Agent: Aviso Urgente (Full Quality REST Version)
 Generates high-quality business recommendations following the official manual.
 """
 
-import json
-import os
-from typing import List, Dict, Any
 from pathlib import Path
-import httpx
 
-class AvisoUrgenteAgent:
-    """Specialist for the AVISO_URGENTE process at Aquaservice."""
-    
-    def __init__(self, model_name: str = "gemini-2.0-flash-exp"):
-        self.model_name = model_name
-        self.api_key = os.getenv("GOOGLE_API_KEY")
-        self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={self.api_key}"
-        self.policy_text = self._load_policy()
-    
-    def _load_policy(self) -> str:
-        base_path = Path(__file__).parent.parent
-        policy_path = base_path / "aviso_urgente" / "policy_aviso_urgente.txt"
-        with open(policy_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    
-    def generate_recommendation(
-        self,
-        messages: List[str],
-        customer_context: Dict[str, Any],
-        rules_decision: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        conversation_text = "\n".join(messages)
-        
-        system_prompt = f"""Eres el Especialista en Aviso Urgente de Aquaservice. Tu misión es gestionar la creación de avisos urgentes o informar de su imposibilidad según la política.
+from .gemini import SpecialistAgent
+
+# Official policy, read once per process
+_POLICY_PATH = Path(__file__).resolve().parent.parent / "aviso_urgente" / "policy_aviso_urgente.txt"
+_POLICY_TEXT = _POLICY_PATH.read_text(encoding="utf-8")
+
+
+# Enforced server-side through generationConfig.response_schema; the
+# property order matches the streamed fields so the titulo arrives first
+RECOMMENDATION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "titulo": {"type": "STRING", "description": "Resumen fase actual (ej: Validación, Solicitud Datos, Confirmación)"},
+        "objetivo": {"type": "STRING", "enum": ["Informar Rechazo", "Pedir Datos", "Confirmar Creación"]},
+        "aviso_permitido": {"type": "BOOLEAN", "description": "Si se puede crear el aviso urgente"},
+        "speech_sugerido": {"type": "STRING", "description": "Guion para el agente, con el formato del canal"},
+        "siguiente_paso": {"type": "STRING", "description": "Acción técnica (ej: Crear Case Salesforce, Nada)"},
+        "gestion_finalizada": {"type": "BOOLEAN"}
+    },
+    "required": ["titulo", "objetivo", "aviso_permitido", "speech_sugerido", "siguiente_paso", "gestion_finalizada"],
+    "propertyOrdering": ["titulo", "objetivo", "aviso_permitido", "speech_sugerido", "siguiente_paso", "gestion_finalizada"]
+}
 
-POLÍTICA OFICIAL:
-{self.policy_text}
 
-REGLAS DE NEGOCIO (DECISIÓN TÉCNICA):
-{json.dumps(rules_decision, indent=2, ensure_ascii=False)}
+SYSTEM_PROMPT = f"""Eres el Especialista en Aviso Urgente de Aquaservice. Tu misión es gestionar la creación de avisos urgentes o informar de su imposibilidad según la política.
 
-CONTEXTO DEL CLIENTE:
-{json.dumps(customer_context, indent=2, ensure_ascii=False)}
+POLÍTICA OFICIAL:
+{_POLICY_TEXT}
 
 INSTRUCCIONES CLAVE:
 0. NO REPETIR PREGUNTAS: Si ya tenemos el producto o cantidad, pasa directo a validación.
@@ -60,40 +51,19 @@ INSTRUCCIONES CLAVE:
    - Si TIENES datos: Verifica los MÍNIMOS (Paso 2).
      - Agua: min 1 botella.
      - Café: min 3 cajas.
-   - Si cumple mínimos: CONFIRMA la creación e informa del plazo (Paso 3 y 4).
+   - Si cumple mínimos: CONFIRMA la creación e informa del plazo (Paso 3 y 4)."""
+
+
+class AvisoUrgenteAgent(SpecialistAgent):
+    """Specialist for the AVISO_URGENTE process at Aquaservice."""
+
+    _system_prefix = SYSTEM_PROMPT
 
-3. FORMATO SALIDA (JSON):
-{{
-  "titulo": "Resumen fase actual (ej: Validación, Solicitud Datos, Confirmación)",
-  "objetivo": "Informar Rechazo | Pedir Datos | Confirmar Creación",
-  "aviso_permitido": true | false,
-  "speech_sugerido": "Guion para el agente",
-  "siguiente_paso": "Acción técnica (ej: Crear Case Salesforce, Nada)",
-  "gestion_finalizada": true | false
-}}"""
+    GENERATION_CONFIG = {
+        "response_mime_type": "application/json",
+        "response_schema": RECOMMENDATION_SCHEMA,
+        "temperature": 0.3
+    }
 
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": f"{system_prompt}\n\nCONVERSACIÓN ACTUAL:\n{conversation_text}\n\nRespuesta JSON:"
-                }]
-            }],
-            "generationConfig": {
-                "response_mime_type": "application/json",
-                "temperature": 0.3
-            }
-        }
-        
-        try:
-            with httpx.Client(timeout=30.0) as client:
-                response = client.post(self.api_url, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                content_text = result['candidates'][0]['content']['parts'][0]['text']
-                data = json.loads(content_text)
-                if isinstance(data, list) and len(data) > 0:
-                    return data[0]
-                return data
-        except Exception as e:
-            print(f"Error in AvisoUrgenteAgent: {e}")
-            return {"titulo": "Error", "speech_sugerido": "Error al conectar con la IA."}
+    RULES_LABEL = "REGLAS DE NEGOCIO (DECISIÓN TÉCNICA):"
+    AGENT_NAME = "AvisoUrgenteAgent"
@@ -0,0 +1,104 @@
+"""
+Micro-Batching Queue
+--------------------
+Collects items submitted concurrently within a short window and hands them to
+a batch handler in one call (e.g. RouterAgent.adetect_process_batch), so a
+burst of requests costs one Gemini round-trip instead of one per request.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set
+
+
+class MicroBatcher:
+    """
+    Dispatches up to `max_size` items per batch, waiting at most `max_wait`
+    seconds after the first item for more to arrive.
+
+    `handler` receives the list of items and must return one result per item,
+    in the same order.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[List[Any]], Awaitable[List[Any]]],
+        max_size: int = 16,
+        max_wait: float = 0.02
+    ):
+        self.handler = handler
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+
+    def start(self) -> None:
+        """Start collecting batches (call from the running event loop)."""
+        self._queue = asyncio.Queue()
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop collecting batches.
+
+        Batches already handed to the handler are drained (their callers get
+        their results). Requests not dispatched yet, whether still queued or
+        in the batch being collected, are cancelled, and later submit() calls
+        raise RuntimeError.
+        """
+        runner, self._runner = self._runner, None
+        if runner is None:
+            return
+        runner.cancel()
+        await asyncio.gather(runner, *self._dispatches, return_exceptions=True)
+        while not self._queue.empty():
+            _, future = self._queue.get_nowait()
+            future.cancel()
+
+    async def submit(self, item: Any) -> Any:
+        """Queue one item and wait for its result."""
+        if self._runner is None:
+            raise RuntimeError("MicroBatcher is not running")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((item, future))
+        return await future
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+            try:
+                while len(batch) < self.max_size:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Stopped while collecting: these items are off the queue already
+                for _, future in batch:
+                    future.cancel()
+                raise
+            # Keep collecting the next batch while this one is in flight
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Any]) -> None:
+        try:
+            results = await self.handler([item for item, _ in batch])
+            for (_, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            # Short result list (or handler cancelled): never leave a caller waiting
+            for _, future in batch:
+                if not future.done():
+                    future.cancel()
@@ -0,0 +1,60 @@
+"""
+In-Process LRU Cache
+--------------------
+Small bounded cache for agent results, keyed by a hash of the prompt inputs.
+"""
+
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Optional, Tuple
+import orjson
+
+
+def hash_key(text: str) -> str:
+    """Compact BLAKE2 digest used as cache key."""
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def hash_json(obj: Any) -> str:
+    """Cache key for JSON-like data (dict key order does not matter)."""
+    data = orjson.dumps(obj, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+class LRUCache:
+    """
+    Least-recently-used cache with a fixed number of entries.
+
+    With `ttl` (seconds) entries also expire that long after being stored.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return the cached value (marking it as recently used) or None."""
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return None
+        expires_at, value = self._data[key]
+        if expires_at and time.monotonic() >= expires_at:
+            del self._data[key]
+            return None
+        return value
+
+    def set(self, key: str, value: Any) -> None:
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0.0
+        self._data[key] = (expires_at, value)
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
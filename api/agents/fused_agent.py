@@ -0,0 +1,91 @@
+"""
+Fused Agent: Router + Stop Reparto
+----------------------------------
+Detects the process and, for STOP_REPARTO, writes the recommendation in the
+same Gemini call. The rules engine needs the extracted `motivo` before it can
+decide, so the caller evaluates the rules for every possible motivo up front
+and the model picks the decision matching the motivo it extracts.
+"""
+
+import logging
+from typing import List, Dict, Any, Optional
+import orjson
+
+from .gemini import GeminiAgent
+from .router import ROUTER_SCHEMA, SYSTEM_PROMPT as ROUTER_PROMPT
+from .stop_reparto_agent import RECOMMENDATION_SCHEMA, SYSTEM_PROMPT as STOP_REPARTO_PROMPT
+
+logger = logging.getLogger("copilot.agents")
+
+# Values of extracted_data.motivo the rules are pre-evaluated for
+MOTIVOS = tuple(ROUTER_SCHEMA["properties"]["extracted_data"]["properties"]["motivo"]["enum"])
+
+FUSED_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        **ROUTER_SCHEMA["properties"],
+        "recommendation": {**RECOMMENDATION_SCHEMA, "nullable": True}
+    },
+    "required": ROUTER_SCHEMA["required"],
+    "propertyOrdering": ["process", "confidence", "extracted_data", "recommendation"]
+}
+
+SYSTEM_PROMPT = f"""{ROUTER_PROMPT}
+
+---
+
+Si el proceso es STOP_REPARTO, genera además la recomendación en `recommendation` actuando como el especialista descrito a continuación. Para cualquier otro proceso, `recommendation` debe ser null.
+
+{STOP_REPARTO_PROMPT}"""
+
+
+class FusedStopRepartoAgent(GeminiAgent):
+    """Router and STOP_REPARTO specialist in a single call."""
+
+    _system_prefix = SYSTEM_PROMPT
+
+    GENERATION_CONFIG = {
+        "response_mime_type": "application/json",
+        "response_schema": FUSED_SCHEMA,
+        "temperature": 0.3
+    }
+
+    def _dynamic_prompt(
+        self,
+        messages: List[str],
+        customer_context: Dict[str, Any],
+        decisions_by_motivo: Dict[str, Dict[str, Any]]
+    ) -> str:
+        conversation_text = "\n".join(messages)
+        return f"""CONVERSACIÓN ACTUAL:
+{conversation_text}
+
+CONTEXTO DEL CLIENTE:
+{orjson.dumps(customer_context, option=orjson.OPT_NON_STR_KEYS).decode()}
+
+REGLAS DE NEGOCIO (VINCULANTES) SEGÚN EL MOTIVO:
+Aplica únicamente la decisión del motivo que extraigas en `extracted_data.motivo`.
+{orjson.dumps(decisions_by_motivo, option=orjson.OPT_NON_STR_KEYS).decode()}
+
+Respuesta JSON:"""
+
+    async def adetect_and_recommend(
+        self,
+        messages: List[str],
+        customer_context: Dict[str, Any],
+        decisions_by_motivo: Dict[str, Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Returns {"process", "confidence", "extracted_data", "recommendation"}
+        (recommendation is None unless the process is STOP_REPARTO), or None
+        if the call failed and the caller should use the two-step flow.
+        """
+        try:
+            content_text = await self._generate(
+                self._dynamic_prompt(messages, customer_context, decisions_by_motivo),
+                self.GENERATION_CONFIG
+            )
+            return orjson.loads(content_text)
+        except Exception:
+            logger.exception("Error in FusedStopRepartoAgent")
+            return None
@@ -0,0 +1,412 @@
+"""
+Gemini REST Base Agent
+----------------------
+Shared plumbing for the agents that call the Gemini REST API: endpoint
+URLs, the pooled HTTP client, explicit context caching of the static
+part of the prompt (v1beta/cachedContents) and rate limiting, plus the
+common recommendation flow of the process specialists.
+"""
+
+import asyncio
+import copy
+import logging
+import os
+import random
+import time
+import weakref
+from contextlib import asynccontextmanager
+from typing import List, Dict, Any, Optional, AsyncIterator, Iterable
+import httpx
+import orjson
+
+from .cache import LRUCache, hash_json
+from .http_client import get_http_client
+from .streaming import PartialJSONFields
+
+logger = logging.getLogger("copilot.agents")
+
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com/v1beta"
+
+# Lifetime of the cached static prompt and how early it gets refreshed
+CACHE_TTL_SECONDS = 3600
+CACHE_REFRESH_MARGIN_SECONDS = 300
+# After a transient failure (429, 5xx, timeout, network...) creation is retried this much later
+CACHE_RETRY_BACKOFF_SECONDS = 60
+# Answers meaning caching will never work for this model/prompt: caching is
+# switched off for the process. Any other error status is retried later
+CACHE_DISABLE_STATUS_CODES = (400, 403, 404)
+
+# Max generate calls in flight at once across all agents (Gemini RPM/TPM quotas)
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))
+# One semaphore per event loop: asyncio primitives cannot be shared across loops
+_GEMINI_SEMAPHORES: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _gemini_semaphore() -> asyncio.Semaphore:
+    loop = asyncio.get_running_loop()
+    semaphore = _GEMINI_SEMAPHORES.get(loop)
+    if semaphore is None:
+        semaphore = _GEMINI_SEMAPHORES[loop] = asyncio.Semaphore(GEMINI_CONCURRENCY)
+    return semaphore
+
+# Rate-limit / overload answers retried with exponential backoff
+RETRY_STATUS_CODES = (429, 503)
+MAX_RETRIES = 3
+RETRY_BASE_DELAY_SECONDS = 0.5
+RETRY_MAX_DELAY_SECONDS = 8.0
+
+# Recommendations for identical (messages, context, rules decision) inputs
+RECOMMENDATION_CACHE_SIZE = 256
+RECOMMENDATION_CACHE_TTL_SECONDS = 600
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    """Seconds to wait before retrying: Retry-After if given, else jittered backoff."""
+    retry_after = response.headers.get("retry-after")
+    if retry_after:
+        try:
+            return min(float(retry_after), RETRY_MAX_DELAY_SECONDS)
+        except ValueError:
+            pass  # HTTP-date form: fall back to backoff
+    delay = min(RETRY_BASE_DELAY_SECONDS * 2 ** attempt, RETRY_MAX_DELAY_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class GeminiAgent:
+    """Base class for agents whose prompt is a static prefix plus a dynamic tail."""
+
+    # Request-independent part of the prompt (policy, instructions, format),
+    # set once by each subclass
+    _system_prefix: str = ""
+
+    def __init__(
+        self,
+        model_name: str = "gemini-2.0-flash-exp",
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
+        self.model_name = model_name
+        self._http_client = http_client
+        self.api_key = os.getenv("GOOGLE_API_KEY")
+        # Sent as a header rather than ?key= so it never shows up in logged URLs
+        self._headers = {"x-goog-api-key": self.api_key or ""}
+        self.api_url = f"{GEMINI_BASE_URL}/models/{model_name}:generateContent"
+        self.stream_url = f"{GEMINI_BASE_URL}/models/{model_name}:streamGenerateContent?alt=sse"
+        self._cache_name: Optional[str] = None
+        self._cache_expires_at = 0.0
+        self._cache_disabled = False
+        self._cache_retry_at = 0.0
+        self._cache_updating = False
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Injected client if any, otherwise the shared pooled one (see http_client.py)."""
+        if self._http_client is not None:
+            return self._http_client
+        return get_http_client()
+
+    async def warmup(self) -> None:
+        """Register the static prompt in the context cache before the first request."""
+        if self.api_key:
+            await self._get_cached_content()
+
+    async def _get_cached_content(self) -> Optional[str]:
+        """
+        Return the name of the cachedContents entry holding the static prompt.
+
+        The entry is created on first use and its TTL is extended shortly before
+        it expires. Returns None when caching is unavailable, in which case the
+        static prompt is sent inline. Requests never wait for another request's
+        cache update: they keep using the current entry while it is valid, or
+        send the prompt inline.
+        """
+        if self._cache_disabled:
+            return None
+        now = time.monotonic()
+        if self._cache_name and now < self._cache_expires_at - CACHE_REFRESH_MARGIN_SECONDS:
+            return self._cache_name
+        if self._cache_updating or now < self._cache_retry_at:
+            return self._cache_name if now < self._cache_expires_at else None
+
+        self._cache_updating = True
+        try:
+            if self._cache_name:
+                await self._refresh_cached_content()
+            else:
+                await self._create_cached_content()
+        except httpx.HTTPStatusError as e:
+            self._cache_name = None
+            if e.response.status_code in CACHE_DISABLE_STATUS_CODES:
+                # Model without caching support or prompt below the minimum
+                # cacheable size: stop trying and always send it inline
+                self._cache_disabled = True
+            else:
+                self._cache_retry_at = time.monotonic() + CACHE_RETRY_BACKOFF_SECONDS
+            logger.warning("Context cache unavailable for %s: %s", type(self).__name__, e)
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            # Network error, timeout or malformed answer: try again later
+            self._cache_name = None
+            self._cache_retry_at = time.monotonic() + CACHE_RETRY_BACKOFF_SECONDS
+            logger.warning("Context cache unavailable for %s: %s", type(self).__name__, e)
+        finally:
+            self._cache_updating = False
+        return self._cache_name
+
+    async def _create_cached_content(self) -> None:
+        payload = {
+            "model": f"models/{self.model_name}",
+            "contents": [{
+                "role": "user",
+                "parts": [{"text": self._system_prefix}]
+            }],
+            "ttl": f"{CACHE_TTL_SECONDS}s"
+        }
+        response = await self.client.post(
+            f"{GEMINI_BASE_URL}/cachedContents",
+            json=payload,
+            headers=self._headers
+        )
+        response.raise_for_status()
+        self._cache_name = orjson.loads(response.content)["name"]
+        self._cache_expires_at = time.monotonic() + CACHE_TTL_SECONDS
+
+    async def _refresh_cached_content(self) -> None:
+        response = await self.client.patch(
+            f"{GEMINI_BASE_URL}/{self._cache_name}?updateMask=ttl",
+            json={"ttl": f"{CACHE_TTL_SECONDS}s"},
+            headers=self._headers
+        )
+        if response.status_code == 404:
+            # Already expired on Gemini's side: register it again
+            await self._create_cached_content()
+            return
+        response.raise_for_status()
+        self._cache_expires_at = time.monotonic() + CACHE_TTL_SECONDS
+
+    async def _build_payload(
+        self,
+        dynamic_text: str,
+        generation_config: Dict[str, Any],
+        use_cache: bool = True
+    ) -> Dict[str, Any]:
+        """Build a generateContent payload, referencing the cached prefix when available."""
+        cache_name = await self._get_cached_content() if use_cache else None
+        if cache_name:
+            return {
+                "cachedContent": cache_name,
+                "contents": [{
+                    "role": "user",
+                    "parts": [{"text": dynamic_text}]
+                }],
+                "generationConfig": generation_config
+            }
+        # Static prefix as its own leading part, byte-identical across calls,
+        # so Gemini's implicit prefix caching can reuse it
+        return {
+            "contents": [{
+                "parts": [
+                    {"text": self._system_prefix},
+                    {"text": dynamic_text}
+                ]
+            }],
+            "generationConfig": generation_config
+        }
+
+    async def _post_generate(self, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        POST to generateContent within the concurrency limit.
+
+        429/503 answers are retried with backoff; the semaphore is released
+        while waiting so other calls are not blocked behind the retry.
+        """
+        for attempt in range(MAX_RETRIES + 1):
+            async with _gemini_semaphore():
+                response = await self.client.post(self.api_url, json=payload, headers=self._headers)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                return response
+            await asyncio.sleep(_retry_delay(response, attempt))
+
+    @asynccontextmanager
+    async def _open_stream(self, payload: Dict[str, Any]) -> AsyncIterator[httpx.Response]:
+        """Streaming counterpart of _post_generate; the slot is held until the stream ends."""
+        for attempt in range(MAX_RETRIES + 1):
+            async with _gemini_semaphore():
+                async with self.client.stream("POST", self.stream_url, json=payload, headers=self._headers) as response:
+                    if response.status_code not in RETRY_STATUS_CODES or attempt == MAX_RETRIES:
+                        yield response
+                        return
+                    await response.aread()
+            await asyncio.sleep(_retry_delay(response, attempt))
+
+    async def _generate(self, dynamic_text: str, generation_config: Dict[str, Any]) -> str:
+        """Call generateContent and return the text of the first candidate."""
+        payload = await self._build_payload(dynamic_text, generation_config)
+        response = await self._post_generate(payload)
+        if response.status_code in (400, 403, 404) and "cachedContent" in payload:
+            # The cache entry may have been evicted: retry with the prompt inline
+            # and register a fresh entry on the next request if that works
+            inline_payload = await self._build_payload(dynamic_text, generation_config, use_cache=False)
+            response = await self._post_generate(inline_payload)
+            if response.is_success:
+                self._cache_name = None
+        response.raise_for_status()
+        result = orjson.loads(response.content)
+        return result['candidates'][0]['content']['parts'][0]['text']
+
+    async def _stream_generate(self, dynamic_text: str, generation_config: Dict[str, Any]) -> AsyncIterator[str]:
+        """Call streamGenerateContent (SSE) and yield text chunks as they arrive."""
+        payload = await self._build_payload(dynamic_text, generation_config)
+        async with self._open_stream(payload) as response:
+            if response.status_code in (400, 403, 404) and "cachedContent" in payload:
+                await response.aread()
+                payload = None
+            else:
+                response.raise_for_status()
+                async for text in self._iter_sse_text(response):
+                    yield text
+        if payload is None:
+            # Same stale-cache fallback as _generate: retry with the prompt inline
+            inline_payload = await self._build_payload(dynamic_text, generation_config, use_cache=False)
+            async with self._open_stream(inline_payload) as response:
+                response.raise_for_status()
+                self._cache_name = None
+                async for text in self._iter_sse_text(response):
+                    yield text
+
+    @staticmethod
+    async def _iter_sse_text(response: httpx.Response) -> AsyncIterator[str]:
+        async for line in response.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            chunk = orjson.loads(line[5:])
+            for candidate in chunk.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
+
+    async def _stream_json(
+        self,
+        dynamic_text: str,
+        generation_config: Dict[str, Any],
+        stream_fields: Iterable[str]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Stream a JSON response.
+
+        Yields {"field": name, "delta": text} while the watched string fields grow,
+        then a final {"result": parsed_json} once the response is complete.
+        """
+        tracker = PartialJSONFields(stream_fields)
+        async for chunk in self._stream_generate(dynamic_text, generation_config):
+            for field, delta in tracker.feed(chunk).items():
+                yield {"field": field, "delta": delta}
+        yield {"result": orjson.loads(tracker.text)}
+
+
+class SpecialistAgent(GeminiAgent):
+    """
+    Base class for the process specialists (STOP_REPARTO, AVISO_URGENTE).
+
+    Subclasses set `_system_prefix`, GENERATION_CONFIG (with their response
+    schema), RULES_LABEL and AGENT_NAME.
+    """
+
+    GENERATION_CONFIG: Dict[str, Any] = {}
+
+    # Heading of the rules decision in the dynamic prompt
+    RULES_LABEL = "REGLAS DE NEGOCIO:"
+
+    # Name used in error logs
+    AGENT_NAME = "SpecialistAgent"
+
+    # Fields forwarded incrementally by astream_recommendation
+    STREAM_FIELDS = ("titulo", "speech_sugerido")
+
+    def __init__(
+        self,
+        model_name: str = "gemini-2.0-flash-exp",
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
+        super().__init__(model_name, http_client)
+        self._recommendation_cache = LRUCache(
+            maxsize=RECOMMENDATION_CACHE_SIZE,
+            ttl=RECOMMENDATION_CACHE_TTL_SECONDS
+        )
+
+    def _dynamic_prompt(
+        self,
+        messages: List[str],
+        customer_context: Dict[str, Any],
+        rules_decision: Dict[str, Any]
+    ) -> str:
+        conversation_text = "\n".join(messages)
+        # Most stable content first: the conversation only grows between turns,
+        # the context and the rules decision change more often
+        return f"""CONVERSACIÓN ACTUAL:
+{conversation_text}
+
+CONTEXTO DEL CLIENTE:
+{orjson.dumps(customer_context, option=orjson.OPT_NON_STR_KEYS).decode()}
+
+{self.RULES_LABEL}
+{orjson.dumps(rules_decision, option=orjson.OPT_NON_STR_KEYS).decode()}
+
+Respuesta JSON:"""
+
+    async def agenerate_recommendation(
+        self,
+        messages: List[str],
+        customer_context: Dict[str, Any],
+        rules_decision: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        try:
+            cache_key = hash_json([messages, customer_context, rules_decision])
+            cached = self._recommendation_cache.get(cache_key)
+            if cached is not None:
+                return copy.deepcopy(cached)
+
+            content_text = await self._generate(
+                self._dynamic_prompt(messages, customer_context, rules_decision),
+                self.GENERATION_CONFIG
+            )
+            data = orjson.loads(content_text)
+            self._recommendation_cache.set(cache_key, copy.deepcopy(data))
+            return data
+        except Exception:
+            logger.exception("Error in %s", self.AGENT_NAME)
+            return {"titulo": "Error", "speech_sugerido": "Error al conectar con la IA."}
+
+    async def astream_recommendation(
+        self,
+        messages: List[str],
+        customer_context: Dict[str, Any],
+        rules_decision: Dict[str, Any]
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Streaming variant of agenerate_recommendation.
+
+        Yields {"field": ..., "delta": ...} while STREAM_FIELDS are generated and
+        a final {"recommendation": ...} with the complete object. A cached
+        recommendation is returned directly, without deltas.
+        """
+        try:
+            cache_key = hash_json([messages, customer_context, rules_decision])
+            cached = self._recommendation_cache.get(cache_key)
+            if cached is not None:
+                yield {"recommendation": copy.deepcopy(cached)}
+                return
+
+            async for update in self._stream_json(
+                self._dynamic_prompt(messages, customer_context, rules_decision),
+                self.GENERATION_CONFIG,
+                self.STREAM_FIELDS
+            ):
+                if "result" not in update:
+                    yield update
+                    continue
+                self._recommendation_cache.set(cache_key, copy.deepcopy(update["result"]))
+                yield {"recommendation": update["result"]}
+        except Exception:
+            logger.exception("Error in %s", self.AGENT_NAME)
+            yield {"recommendation": {"titulo": "Error", "speech_sugerido": "Error al conectar con la IA."}}
@@ -0,0 +1,87 @@
+"""
+Shared HTTP Client
+------------------
+Single pooled httpx.AsyncClient reused by every agent and by the TTS proxy,
+so outbound calls don't open a new TCP+TLS connection per request. HTTP/2
+lets concurrent requests to the same host share one connection.
+
+Pooled connections belong to the event loop that opened them, so the client
+is tied to that loop and replaced when called from another one (serverless
+handlers may run each request on a fresh loop, without the lifespan).
+"""
+
+import asyncio
+from typing import Any, Optional
+import httpx
+
+
+def _running_loop() -> Optional[asyncio.AbstractEventLoop]:
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+
+
+class LoopBoundClient:
+    """
+    Lazily created httpx.AsyncClient tied to the event loop that created it.
+
+    `client_options` are passed to httpx.AsyncClient (base_url, headers,
+    http2, limits, timeout...) every time the client is (re)created.
+    """
+
+    def __init__(self, **client_options: Any):
+        self._client_options = client_options
+        self._client: Optional[httpx.AsyncClient] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def get(self) -> httpx.AsyncClient:
+        """Get or create the client for the running event loop."""
+        loop = _running_loop()
+        if self._client is None or self._client.is_closed or self._loop is not loop:
+            # A client from another loop cannot be closed from here; its
+            # connections are dropped with it
+            self._loop = loop
+            self._client = httpx.AsyncClient(**self._client_options)
+        return self._client
+
+    async def aclose(self) -> None:
+        """Close the client if it belongs to the running loop, and forget it."""
+        if self._client is not None and self._loop is _running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._loop = None
+
+
+_shared = LoopBoundClient(
+    http2=True,
+    timeout=httpx.Timeout(30.0, connect=3.0),
+    limits=httpx.Limits(
+        max_connections=100,
+        max_keepalive_connections=32,
+        keepalive_expiry=30
+    )
+)
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Get or create the shared async client for the running event loop."""
+    return _shared.get()
+
+
+async def close_http_client() -> None:
+    """Close the shared client (called on application shutdown)."""
+    await _shared.aclose()
+
+
+async def prewarm_connection(url: str, timeout: float = 5.0) -> None:
+    """
+    Open a pooled connection to `url`'s host ahead of time (DNS + TLS handshake).
+
+    The response itself is irrelevant; failures are ignored so startup never
+    depends on the remote host being reachable.
+    """
+    try:
+        await get_http_client().head(url, timeout=timeout)
+    except httpx.HTTPError:
+        pass
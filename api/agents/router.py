@@ -5,23 +5,141 @@ Analyzes customer conversation using direct REST calls to Gemini API.
 Includes full context and few-shot examples for high accuracy.
 """
 
-import json
+import asyncio
+import copy
+import logging
 import os
-from typing import List, Dict, Any
+import re
+import unicodedata
+from typing import List, Dict, Any, Optional
 import httpx
+import orjson
 
-class RouterAgent:
-    """Detects which business process applies to a customer conversation."""
+from .cache import LRUCache, hash_key
+from .gemini import GeminiAgent
+
+logger = logging.getLogger("copilot.agents")
+
+# Max number of conversations whose detection is kept in memory, and for how long
+DETECTION_CACHE_SIZE = int(os.getenv("DETECTION_CACHE_SIZE", "1024"))
+DETECTION_CACHE_TTL_SECONDS = 600
+
+# Second tier (opt-in): reuse the detection of conversations that only differ
+# in case, accents, punctuation or spacing
+DETECTION_NORMALIZED_CACHE = os.getenv("DETECTION_NORMALIZED_CACHE", "0") == "1"
+
+_NON_WORD_RE = re.compile(r"[\W_]+")
+
+
+def _detection_key(messages: List[str]) -> str:
+    """Exact cache key; the separator keeps ["a", "b"] apart from ["a\\nb"]."""
+    return hash_key("\x00".join(messages))
+
+
+def _normalize_message(message: str) -> str:
+    text = unicodedata.normalize("NFKD", message.lower())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return _NON_WORD_RE.sub(" ", text).strip()
+
+
+def _normalized_key(messages: List[str]) -> str:
+    """Cache key for the normalized tier (see DETECTION_NORMALIZED_CACHE)."""
+    return hash_key("\x00".join(_normalize_message(m) for m in messages))
+
+# Messages made only of greetings/thanks: SOCIAL without asking Gemini
+_GREETING_ONLY_RE = re.compile(
+    r"\W*(?:(?:hola|buen[oa]s(?:\s+(?:d[ií]as|tardes|noches))?|(?:muchas\s+)?gracias"
+    r"|adi[oó]s|hasta\s+luego|vale|ok)\W*)+",
+    re.IGNORECASE
+)
+
+# Unambiguous phrases from REGLAS DE DISTINCIÓN (see SYSTEM_PROMPT). Only an
+# explicit stop intent counts: "vacaciones" or "tengo mucha agua" alone are
+# motivos, not requests (see _MOTIVO_PATTERNS)
+_STOP_RE = re.compile(r"no vengas|\banula(?:r|do|da)?\b|\bparar\b|\bstop\b", re.IGNORECASE)
+_AVISO_RE = re.compile(
+    r"urgente|sin agua|sin c[aá]psulas|p[aá]sate ya|necesito botellas"
+    r"|me he quedado sin (?:agua|caf[eé]|c[aá]psulas|botellas|nada)",
+    re.IGNORECASE
+)
+# Questions ("¿y si estoy sin agua?") do not count as requests; the opening
+# "¿" is optional, as customers often leave it out
+_QUESTION_RE = re.compile(r"¿[^?]*\?|[^.!?¿\n]*\?")
+# Negated requests ("no quiero parar...", "no me he quedado sin agua") are left to Gemini
+_NEGATION_RE = re.compile(
+    r"\bno\s+(?:quiero|es|necesito|hace\s+falta|me\s+he\s+quedado)\b",
+    re.IGNORECASE
+)
+
+_MOTIVO_PATTERNS = (
+    ("exceso_agua", re.compile(r"mucha agua|agua acumulada|me sobra agua|exceso de agua", re.IGNORECASE)),
+    ("ausencia_vacaciones", re.compile(r"vacaciones|ausen(?:te|cia)|de viaje|fuera de casa", re.IGNORECASE)),
+)
+_PLAN_PATTERNS = (
+    ("Ahorro", re.compile(r"\bahorro\b", re.IGNORECASE)),
+    ("Planocho", re.compile(r"plan\s*ocho", re.IGNORECASE)),
+)
+_PUNTUAL_RE = re.compile(r"esta vez|solo hoy|puntual", re.IGNORECASE)
+_PRODUCTO_PATTERNS = (
+    ("cafe", re.compile(r"caf[eé]|c[aá]psulas", re.IGNORECASE)),
+    ("agua", re.compile(r"agua|botell|garraf", re.IGNORECASE)),
+)
+_CANTIDAD_RE = re.compile(r"\b\d+\s*(?:botellas?|garrafas?|cajas?)\b", re.IGNORECASE)
+
+# Confidence reported for keyword-based detections
+KEYWORD_CONFIDENCE = 0.95
+
+
+def _first_match(patterns, text: str) -> Optional[str]:
+    """Value of the only pattern that matches `text`, None if zero or several match."""
+    found = [value for value, pattern in patterns if pattern.search(text)]
+    return found[0] if len(found) == 1 else None
+
+
+def _classify_by_keywords(messages: List[str]) -> Optional[Dict[str, Any]]:
+    """
+    Deterministic fast path for obvious conversations.
     
-    def __init__(self, model_name: str = "gemini-2.0-flash-exp"):
-        self.model_name = model_name
-        self.api_key = os.getenv("GOOGLE_API_KEY")
-        self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={self.api_key}"
-        
-    def detect_process(self, messages: List[str]) -> Dict[str, Any]:
-        conversation_text = "\n".join(messages)
-        
-        system_prompt = """Eres el Coordinador de Triaje de Aquaservice. Tu misión es analizar la conversación y determinar el proceso de negocio y extraer datos clave.
+    Returns a detection in the same shape as Gemini's, or None when the
+    conversation is ambiguous and has to go through the LLM.
+    """
+    if not messages:
+        return None
+    if all(_GREETING_ONLY_RE.fullmatch(m) for m in messages):
+        return {"process": "SOCIAL", "confidence": KEYWORD_CONFIDENCE, "extracted_data": {}}
+
+    text = "\n".join(messages)
+    statements = _QUESTION_RE.sub(" ", text)
+    is_stop = bool(_STOP_RE.search(statements))
+    is_aviso = bool(_AVISO_RE.search(statements))
+    if is_stop == is_aviso or _NEGATION_RE.search(text):
+        return None
+
+    if is_stop:
+        motivo = _first_match(_MOTIVO_PATTERNS, text)
+        if motivo is None:
+            # motivo is a required field: let Gemini infer it from the wording
+            return None
+        extracted_data = {
+            "motivo": motivo,
+            "plan": _first_match(_PLAN_PATTERNS, text),
+            "es_puntual": True if _PUNTUAL_RE.search(text) else None,
+        }
+        return {"process": "STOP_REPARTO", "confidence": KEYWORD_CONFIDENCE, "extracted_data": extracted_data}
+
+    producto = _first_match(_PRODUCTO_PATTERNS, text)
+    if producto is None:
+        # "urgente" alone does not say what is needed (or whether anything is)
+        return None
+    cantidad = _CANTIDAD_RE.search(text)
+    extracted_data = {
+        "producto": producto,
+        "cantidad": cantidad.group(0) if cantidad else None,
+    }
+    return {"process": "AVISO_URGENTE", "confidence": KEYWORD_CONFIDENCE, "extracted_data": extracted_data}
+
+
+SYSTEM_PROMPT = """Eres el Coordinador de Triaje de Aquaservice. Tu misión es analizar la conversación y determinar el proceso de negocio y extraer datos clave.
 
 PROCESOS DISPONIBLES:
 - STOP_REPARTO: El cliente quiere pausar, parar, anular o mover su reparto programado.
@@ -47,44 +165,145 @@ EJEMPLOS:
 - "Hola, necesito agua urgente" -> process: AVISO_URGENTE, producto: agua
 - "Oye, que me voy de vacaciones y quiero parar el pedido" -> process: STOP_REPARTO, motivo: ausencia_vacaciones
 - "Me he quedado sin cápsulas, ¿podéis traerme?" -> process: AVISO_URGENTE, producto: cafe
-- "Buenas tardes, ¿cómo va todo?" -> process: SOCIAL
-
-FORMATO DE SALIDA (JSON ESTRICTO):
-{
-  "process": "STOP_REPARTO" | "AVISO_URGENTE" | "SOCIAL" | "UNKNOWN",
-  "confidence": 0.0-1.0,
-  "extracted_data": {
-     "motivo": string | null,
-     "plan": string | null,
-     "es_puntual": boolean | null,
-     "producto": string | null,
-     "cantidad": string | number | null
-  }
-}"""
-
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": f"{system_prompt}\n\nCONVERSACIÓN:\n{conversation_text}\n\nRespuesta JSON:"
-                }]
-            }],
-            "generationConfig": {
-                "response_mime_type": "application/json",
-                "temperature": 0.1
+- "Buenas tardes, ¿cómo va todo?" -> process: SOCIAL"""
+
+# Enforced server-side through generationConfig.response_schema
+ROUTER_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "process": {
+            "type": "STRING",
+            "enum": ["STOP_REPARTO", "AVISO_URGENTE", "SOCIAL", "UNKNOWN"]
+        },
+        "confidence": {"type": "NUMBER"},
+        "extracted_data": {
+            "type": "OBJECT",
+            "properties": {
+                "motivo": {"type": "STRING", "enum": ["exceso_agua", "ausencia_vacaciones", "otro"], "nullable": True},
+                "plan": {"type": "STRING", "enum": ["Ahorro", "Planocho"], "nullable": True},
+                "es_puntual": {"type": "BOOLEAN", "nullable": True},
+                "producto": {"type": "STRING", "enum": ["agua", "cafe"], "nullable": True},
+                "cantidad": {"type": "STRING", "nullable": True}
             }
         }
-        
+    },
+    "required": ["process", "confidence"]
+}
+
+# Several conversations classified in one call; `index` ties each item back to its input
+BATCH_ROUTER_SCHEMA = {
+    "type": "ARRAY",
+    "items": {
+        "type": "OBJECT",
+        "properties": {"index": {"type": "INTEGER"}, **ROUTER_SCHEMA["properties"]},
+        "required": ["index", *ROUTER_SCHEMA["required"]]
+    }
+}
+
+
+class RouterAgent(GeminiAgent):
+    """Detects which business process applies to a customer conversation."""
+
+    _system_prefix = SYSTEM_PROMPT
+
+    GENERATION_CONFIG = {
+        "response_mime_type": "application/json",
+        "response_schema": ROUTER_SCHEMA,
+        "temperature": 0.1
+    }
+
+    BATCH_GENERATION_CONFIG = {
+        **GENERATION_CONFIG,
+        "response_schema": BATCH_ROUTER_SCHEMA
+    }
+
+    def __init__(
+        self,
+        model_name: str = "gemini-2.0-flash-exp",
+        http_client: Optional[httpx.AsyncClient] = None
+    ):
+        super().__init__(model_name, http_client)
+        self._detection_cache = LRUCache(maxsize=DETECTION_CACHE_SIZE, ttl=DETECTION_CACHE_TTL_SECONDS)
+        self._normalized_cache = (
+            LRUCache(maxsize=DETECTION_CACHE_SIZE, ttl=DETECTION_CACHE_TTL_SECONDS)
+            if DETECTION_NORMALIZED_CACHE else None
+        )
+
+    def _cache_detection(self, messages: List[str], detection: Dict[str, Any]) -> None:
+        """Store a Gemini detection (only the router output is ever cached)."""
+        self._detection_cache.set(_detection_key(messages), copy.deepcopy(detection))
+        if self._normalized_cache is not None:
+            self._normalized_cache.set(_normalized_key(messages), copy.deepcopy(detection))
+
+    def peek_detection(self, messages: List[str]) -> Optional[Dict[str, Any]]:
+        """Detection available without calling Gemini (keywords or cache), else None."""
+        detection = _classify_by_keywords(messages)
+        if detection is not None:
+            return detection
+        cached = self._detection_cache.get(_detection_key(messages))
+        if cached is None and self._normalized_cache is not None:
+            cached = self._normalized_cache.get(_normalized_key(messages))
+        return copy.deepcopy(cached) if cached is not None else None
+
+    async def adetect_process(self, messages: List[str]) -> Dict[str, Any]:
+        detection = self.peek_detection(messages)
+        if detection is not None:
+            return detection
+
+        conversation_text = "\n".join(messages)
         try:
-            with httpx.Client(timeout=30.0) as client:
-                response = client.post(self.api_url, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                content_text = result['candidates'][0]['content']['parts'][0]['text']
-                data = json.loads(content_text)
-                # Handle case where Gemini returns a list instead of a dict
-                if isinstance(data, list) and len(data) > 0:
-                    return data[0]
-                return data
-        except Exception as e:
-            print(f"Error in RouterAgent: {e}")
+            content_text = await self._generate(
+                f"CONVERSACIÓN:\n{conversation_text}\n\nRespuesta JSON:",
+                self.GENERATION_CONFIG
+            )
+            data = orjson.loads(content_text)
+            self._cache_detection(messages, data)
+            return data
+        except Exception:
+            logger.exception("Error in RouterAgent")
             return {"process": "UNKNOWN", "confidence": 0, "extracted_data": {}}
+
+    async def adetect_process_batch(self, messages_list: List[List[str]]) -> List[Dict[str, Any]]:
+        """
+        Detect the process of several conversations with a single Gemini call.
+        
+        Conversations resolved by keywords or by the detection cache are not
+        sent. If the batched answer is missing any conversation, those are
+        retried one by one with adetect_process.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(messages_list)
+        pending: Dict[int, str] = {}
+        for i, messages in enumerate(messages_list):
+            detection = self.peek_detection(messages)
+            if detection is None:
+                pending[i] = "\n".join(messages)
+            else:
+                results[i] = detection
+
+        if len(pending) == 1:
+            (i,) = pending
+            results[i] = await self.adetect_process(messages_list[i])
+        elif pending:
+            conversations = "\n\n".join(
+                f"CONVERSACIÓN {i}:\n{text}" for i, text in pending.items()
+            )
+            try:
+                content_text = await self._generate(
+                    f"{conversations}\n\nDevuelve un objeto por conversación con su número en 'index'.\n\nRespuesta JSON:",
+                    self.BATCH_GENERATION_CONFIG
+                )
+                for item in orjson.loads(content_text):
+                    i = item.pop("index", None)
+                    if i in pending and results[i] is None:
+                        self._cache_detection(messages_list[i], item)
+                        results[i] = item
+            except Exception:
+                logger.exception("Error in RouterAgent batch, falling back to one call per conversation")
+
+            missing = [i for i in pending if results[i] is None]
+            for i, detection in zip(missing, await asyncio.gather(
+                *(self.adetect_process(messages_list[i]) for i in missing)
+            )):
+                results[i] = detection
+
+        return results
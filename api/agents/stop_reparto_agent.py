@@ -4,45 +4,36 @@ Specialist Agent: Stop Reparto (Full Quality REST Version)
 Generates high-quality business recommendations following the official manual.
 """
 
-import json
-import os
-from typing import List, Dict, Any
 from pathlib import Path
-import httpx
 
-class StopRepartoAgent:
-    """Specialist for the STOP_REPARTO process at Aquaservice."""
-    
-    def __init__(self, model_name: str = "gemini-2.0-flash-exp"):
-        self.model_name = model_name
-        self.api_key = os.getenv("GOOGLE_API_KEY")
-        self.api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={self.api_key}"
-        self.policy_text = self._load_policy()
-    
-    def _load_policy(self) -> str:
-        base_path = Path(__file__).parent.parent
-        policy_path = base_path / "stop_reparto" / "policy_stop_reparto.txt"
-        with open(policy_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    
-    def generate_recommendation(
-        self,
-        messages: List[str],
-        customer_context: Dict[str, Any],
-        rules_decision: Dict[str, Any]
-    ) -> Dict[str, Any]:
-        conversation_text = "\n".join(messages)
-        
-        system_prompt = f"""Eres el Especialista en Stop Reparto de Aquaservice. Tu misión es maximizar la satisfacción y el FCR siguiendo la política oficial.
+from .gemini import SpecialistAgent
+
+# Official policy, read once per process
+_POLICY_PATH = Path(__file__).resolve().parent.parent / "stop_reparto" / "policy_stop_reparto.txt"
+_POLICY_TEXT = _POLICY_PATH.read_text(encoding="utf-8")
+
+
+# Enforced server-side through generationConfig.response_schema; the
+# property order matches the streamed fields so the titulo arrives first
+RECOMMENDATION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "titulo": {"type": "STRING", "description": "Resumen corto de la fase actual"},
+        "objetivo": {"type": "STRING", "enum": ["Reconducción", "Decisión", "FCR"]},
+        "stop_permitido": {"type": "BOOLEAN", "description": "Si se permite el stop del reparto"},
+        "speech_sugerido": {"type": "STRING", "description": "Guion exacto para el agente, con el formato del canal"},
+        "siguiente_paso": {"type": "STRING", "description": "Acción técnica en CRM/Salesforce"},
+        "gestion_finalizada": {"type": "BOOLEAN"}
+    },
+    "required": ["titulo", "objetivo", "stop_permitido", "speech_sugerido", "siguiente_paso", "gestion_finalizada"],
+    "propertyOrdering": ["titulo", "objetivo", "stop_permitido", "speech_sugerido", "siguiente_paso", "gestion_finalizada"]
+}
 
-POLÍTICA OFICIAL:
-{self.policy_text}
 
-REGLAS DE NEGOCIO (VINCULANTES):
-{json.dumps(rules_decision, indent=2, ensure_ascii=False)}
+SYSTEM_PROMPT = f"""Eres el Especialista en Stop Reparto de Aquaservice. Tu misión es maximizar la satisfacción y el FCR siguiendo la política oficial.
 
-CONTEXTO DEL CLIENTE:
-{json.dumps(customer_context, indent=2, ensure_ascii=False)}
+POLÍTICA OFICIAL:
+{_POLICY_TEXT}
 
 INSTRUCCIONES CRÍTICAS:
 1. CANAL: El campo `canal` del `customer_context` es CRÍTICO para el formato del `speech_sugerido`.
@@ -52,41 +43,19 @@ INSTRUCCIONES CRÍTICAS:
 3. NO REPETIR PREGUNTAS: Si la información ya está en el chat o en el contexto, no la vuelvas a pedir.
 4. FLUJO DE DECISIÓN: Si el cliente ya rechazó alternativas, pasa directo a la DECISIÓN técnica.
 5. COSTES: Respeta escrupulosamente los costes de anulación indicados en las REGLAS DE NEGOCIO basándote en el scoring y el plan.
-6. CRM: El campo `siguiente_paso` debe contener la instrucción técnica exacta para Salesforce (ej: "Marcar check Anular Reparto en el pedido pedagógico").
+6. CRM: El campo `siguiente_paso` debe contener la instrucción técnica exacta para Salesforce (ej: "Marcar check Anular Reparto en el pedido pedagógico")."""
+
+
+class StopRepartoAgent(SpecialistAgent):
+    """Specialist for the STOP_REPARTO process at Aquaservice."""
+
+    _system_prefix = SYSTEM_PROMPT
 
-FORMATO DE SALIDA (JSON):
-{{
-  "titulo": "Resumen corto de la fase actual",
-  "objetivo": "Reconducción | Decisión | FCR",
-  "stop_permitido": true | false,
-  "speech_sugerido": "Guion exacto para el agente",
-  "siguiente_paso": "Acción técnica en CRM/Salesforce",
-  "gestion_finalizada": true | false
-}}"""
+    GENERATION_CONFIG = {
+        "response_mime_type": "application/json",
+        "response_schema": RECOMMENDATION_SCHEMA,
+        "temperature": 0.4
+    }
 
-        payload = {
-            "contents": [{
-                "parts": [{
-                    "text": f"{system_prompt}\n\nCONVERSACIÓN ACTUAL:\n{conversation_text}\n\nRespuesta JSON:"
-                }]
-            }],
-            "generationConfig": {
-                "response_mime_type": "application/json",
-                "temperature": 0.4
-            }
-        }
-        
-        try:
-            with httpx.Client(timeout=30.0) as client:
-                response = client.post(self.api_url, json=payload)
-                response.raise_for_status()
-                result = response.json()
-                content_text = result['candidates'][0]['content']['parts'][0]['text']
-                data = json.loads(content_text)
-                # Handle case where Gemini returns a list instead of a dict
-                if isinstance(data, list) and len(data) > 0:
-                    return data[0]
-                return data
-        except Exception as e:
-            print(f"Error in StopRepartoAgent: {e}")
-            return {"titulo": "Error", "speech_sugerido": "Error al conectar con la IA."}
+    RULES_LABEL = "REGLAS DE NEGOCIO (VINCULANTES):"
+    AGENT_NAME = "StopRepartoAgent"
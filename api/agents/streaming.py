@@ -0,0 +1,68 @@
+"""
+Incremental JSON Field Extraction
+---------------------------------
+Extracts the growing value of selected top-level string fields from a JSON
+document that is still being streamed, so partial text (e.g. speech_sugerido)
+can be forwarded before the whole object is complete.
+"""
+
+import re
+from typing import Dict, Iterable
+import orjson
+
+
+def _decode_partial(raw: str) -> str:
+    """Decode the body of a JSON string that may be cut mid-escape."""
+    # A truncated escape sequence is at most 6 chars long (\uXXXX)
+    for cut in range(min(len(raw), 6) + 1):
+        try:
+            return orjson.loads(f'"{raw[:len(raw) - cut]}"')
+        except ValueError:
+            continue
+    return ""
+
+
+class PartialJSONFields:
+    """Tracks streamed text and reports what was appended to each watched field."""
+
+    def __init__(self, fields: Iterable[str]):
+        self._patterns = {
+            field: re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+            for field in fields
+        }
+        self._emitted: Dict[str, str] = {field: "" for field in self._patterns}
+        self.text = ""
+
+    def feed(self, chunk: str) -> Dict[str, str]:
+        """
+        Append a chunk of streamed text.
+
+        Returns:
+            Mapping of field -> newly available text (only fields that grew)
+        """
+        self.text += chunk
+        deltas = {}
+        for field, pattern in self._patterns.items():
+            match = pattern.search(self.text)
+            if not match:
+                continue
+            value = _decode_partial(self._string_body(match.end()))
+            previous = self._emitted[field]
+            if len(value) > len(previous) and value.startswith(previous):
+                deltas[field] = value[len(previous):]
+                self._emitted[field] = value
+        return deltas
+
+    def _string_body(self, start: int) -> str:
+        """Raw (still escaped) content of the JSON string starting at `start`."""
+        text = self.text
+        i = start
+        while i < len(text):
+            char = text[i]
+            if char == "\\":
+                i += 2
+                continue
+            if char == '"':
+                break
+            i += 1
+        return text[start:min(i, len(text))]
@@ -0,0 +1,40 @@
+"""
+ElevenLabs Client
+-----------------
+Pooled httpx.AsyncClient and audio file helper shared by the MCP servers, so
+tool calls reuse their connections to the ElevenLabs API.
+
+The client is tied to the event loop that created it and replaced when called
+from another one (see agents/http_client.py).
+"""
+
+import os
+import httpx
+
+from agents.http_client import LoopBoundClient
+
+_shared = LoopBoundClient(
+    http2=True,
+    limits=httpx.Limits(
+        max_connections=100,
+        max_keepalive_connections=20,
+        keepalive_expiry=300
+    )
+)
+
+
+def get_client() -> httpx.AsyncClient:
+    """Get or create the shared async client for the running event loop."""
+    return _shared.get()
+
+
+async def close_client() -> None:
+    """Close the shared client (called on application shutdown)."""
+    await _shared.aclose()
+
+
+def write_mp3(path: str, data: bytes) -> None:
+    """Write an audio file, creating its directory if needed (run in a worker thread)."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
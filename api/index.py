@@ -7,8 +7,12 @@ Orchestrates the multi-agent pipeline:
 3. Specialist agent generates recommendation
 """
 
+import asyncio
+import logging
 import os
 import sys
+from collections import Counter
+from contextlib import asynccontextmanager
 from pathlib import Path
 
 # Fix paths for Vercel
@@ -16,31 +20,122 @@ current_dir = os.path.dirname(os.path.abspath(__file__))
 if current_dir not in sys.path:
     sys.path.insert(0, current_dir)
 
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, HTTPException, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, ORJSONResponse, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from starlette.background import BackgroundTask
+from pydantic import BaseModel, Field, ValidationError, field_validator
 from typing import List, Dict, Any, Optional
 from dotenv import load_dotenv
+import orjson
 
 # Load environment variables
 load_dotenv()
 
-# Universal imports (works local and Vercel)
+# Universal imports (works local and Vercel). The agent modules themselves
+# (httpx, prompts, policies) are only imported when first used: see agents/__init__.py
 try:
-    from rules_engine import load_rules_engine
+    from rules_engine import load_rules_engine_async
+    import agents
     from agents import create_router_agent, create_stop_reparto_agent, create_aviso_urgente_agent
+    from agents import create_fused_stop_reparto_agent
+    from agents.cache import LRUCache
 except ImportError:
-    from api.rules_engine import load_rules_engine
+    from api.rules_engine import load_rules_engine_async
+    from api import agents
     from api.agents import create_router_agent, create_stop_reparto_agent, create_aviso_urgente_agent
+    from api.agents import create_fused_stop_reparto_agent
+    from api.agents.cache import LRUCache
+
+
+logger = logging.getLogger("copilot")
+
+# Processes whose rules are loaded speculatively while the router runs: the
+# SPECULATIVE_TOP_K most often detected so far (initially in this order)
+SPECULATIVE_PROCESSES = ("STOP_REPARTO", "AVISO_URGENTE")
+SPECULATIVE_TOP_K = int(os.getenv("SPECULATIVE_TOP_K", "2"))
+# Detections (with rules) seen by this worker
+_process_counts = Counter(dict.fromkeys(SPECULATIVE_PROCESSES, 0))
+
+# Max pipelines running at once inside a single /api/analyze_batch call
+BATCH_CONCURRENCY = 8
+
+# Router calls of concurrent /api/analyze requests arriving within
+# ANALYZE_BATCH_WAIT_MS are merged into one batch call (1 = disabled)
+ANALYZE_BATCH_MAX = int(os.getenv("ANALYZE_BATCH_MAX", "1"))
+ANALYZE_BATCH_WAIT_MS = float(os.getenv("ANALYZE_BATCH_WAIT_MS", "20"))
+
+# Min router confidence to accept the fused STOP_REPARTO recommendation
+FUSED_MIN_CONFIDENCE = 0.7
+
+# Deployed processes rarely change: /api/processes rescans at most this often
+PROCESSES_CACHE_TTL_SECONDS = 60
+_processes_cache = LRUCache(maxsize=1, ttl=PROCESSES_CACHE_TTL_SECONDS)
+
+# Hosts whose connection (DNS + TLS) is opened at startup
+PREWARM_URLS = (
+    "https://generativelanguage.googleapis.com/",
+    "https://api.elevenlabs.io/"
+)
 
 
 # Request/Response Models
+# Integers orjson can encode (responses, cache keys and prompts all use it)
+_JSON_INT_MIN, _JSON_INT_MAX = -(2 ** 63), 2 ** 64 - 1
+
+
+def _check_json_ints(value: Any) -> None:
+    """Raise ValueError if `value` holds an integer orjson cannot encode."""
+    if isinstance(value, int):
+        if not _JSON_INT_MIN <= value <= _JSON_INT_MAX:
+            raise ValueError("Integer exceeds 64-bit range")
+    elif isinstance(value, dict):
+        for item in value.values():
+            _check_json_ints(item)
+    elif isinstance(value, list):
+        for item in value:
+            _check_json_ints(item)
+
+
 class AnalyzeRequest(BaseModel):
     """Request model for conversation analysis."""
     messages: List[str] = Field(description="List of customer messages")
     customer_context: Dict[str, Any] = Field(description="Customer context data")
 
+    @field_validator("customer_context")
+    @classmethod
+    def _encodable_context(cls, value: Dict[str, Any]) -> Dict[str, Any]:
+        _check_json_ints(value)
+        return value
+
+
+async def parse_analyze_request(request: Request) -> AnalyzeRequest:
+    """
+    Validate an AnalyzeRequest body straight from the raw bytes.
+    
+    pydantic-core parses and validates the JSON in one step, instead of FastAPI
+    decoding it with the stdlib json module first. Errors are reported as the
+    usual 422 response.
+    """
+    try:
+        return AnalyzeRequest.model_validate_json(await request.body())
+    except ValidationError as e:
+        raise RequestValidationError([
+            {**error, "loc": ("body", *error["loc"])}
+            for error in e.errors(include_url=False)
+        ])
+
+
+# Request body documentation for the endpoints using parse_analyze_request
+ANALYZE_REQUEST_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": AnalyzeRequest.model_json_schema()}}
+    }
+}
+
 
 class AnalyzeResponse(BaseModel):
     """Response model for analysis results."""
@@ -52,11 +147,44 @@ class AnalyzeResponse(BaseModel):
     enriched_context: Optional[Dict[str, Any]] = Field(default=None, description="The customer context after LLM extraction")
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Open the shared Gemini HTTP client and create the agents on startup, so the
+    first request doesn't pay for their initialization; close the client on shutdown.
+    """
+    app.state.http = agents.get_http_client()
+    # Warm connections first so the cache registrations below reuse them
+    await asyncio.gather(*(agents.prewarm_connection(url) for url in PREWARM_URLS))
+    app.state.router_agent = create_router_agent(http_client=app.state.http)
+    app.state.stop_reparto_agent = create_stop_reparto_agent(http_client=app.state.http)
+    app.state.aviso_urgente_agent = create_aviso_urgente_agent(http_client=app.state.http)
+    await asyncio.gather(
+        app.state.router_agent.warmup(),
+        app.state.stop_reparto_agent.warmup(),
+        app.state.aviso_urgente_agent.warmup()
+    )
+    if ANALYZE_BATCH_MAX > 1:
+        app.state.detection_batcher = agents.MicroBatcher(
+            app.state.router_agent.adetect_process_batch,
+            max_size=ANALYZE_BATCH_MAX,
+            max_wait=ANALYZE_BATCH_WAIT_MS / 1000
+        )
+        app.state.detection_batcher.start()
+    yield
+    if getattr(app.state, "detection_batcher", None) is not None:
+        await app.state.detection_batcher.stop()
+    await agents.close_http_client()
+    app.state.http = None
+
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Customer Service Copilot API",
     description="Internal copilot for customer service agents",
-    version="1.1.0"
+    version="1.1.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
 # Configure CORS for local development
@@ -69,36 +197,42 @@ app.add_middleware(
 )
 
 
-# Initialize agents
-router_agent = None
-stop_reparto_agent = None
+# Agents are created once at startup (see lifespan) and kept on app.state
+def _get_agent(name: str, factory):
+    """Get an agent from app.state, creating it if the lifespan did not run."""
+    agent = getattr(app.state, name, None)
+    if agent is None:
+        agent = factory(http_client=getattr(app.state, "http", None))
+        setattr(app.state, name, agent)
+    return agent
 
 
 def get_router_agent():
-    """Get or create router agent (lazy initialization)."""
-    global router_agent
-    if router_agent is None:
-        router_agent = create_router_agent()
-    return router_agent
+    """Get the router agent."""
+    return _get_agent("router_agent", create_router_agent)
 
 
 def get_stop_reparto_agent():
-    """Get or create STOP_REPARTO agent (lazy initialization)."""
-    global stop_reparto_agent
-    if stop_reparto_agent is None:
-        stop_reparto_agent = create_stop_reparto_agent()
-    return stop_reparto_agent
-
+    """Get the STOP_REPARTO agent."""
+    return _get_agent("stop_reparto_agent", create_stop_reparto_agent)
 
-# Initialize Aviso Urgente agent
-aviso_urgente_agent = None
 
 def get_aviso_urgente_agent():
-    """Get or create AVISO_URGENTE agent (lazy initialization)."""
-    global aviso_urgente_agent
-    if aviso_urgente_agent is None:
-        aviso_urgente_agent = create_aviso_urgente_agent()
-    return aviso_urgente_agent
+    """Get the AVISO_URGENTE agent."""
+    return _get_agent("aviso_urgente_agent", create_aviso_urgente_agent)
+
+
+def get_fused_stop_reparto_agent():
+    """Get the fused Router + STOP_REPARTO agent (see run_fused_pipeline)."""
+    return _get_agent("fused_stop_reparto_agent", create_fused_stop_reparto_agent)
+
+
+async def detect_process(messages: List[str]) -> Dict[str, Any]:
+    """Router detection, merged with concurrent requests when batching is enabled."""
+    batcher = getattr(app.state, "detection_batcher", None)
+    if batcher is not None:
+        return await batcher.submit(messages)
+    return await get_router_agent().adetect_process(messages)
 
 
 @app.get("/api/health")
@@ -111,135 +245,370 @@ async def health_check():
     }
 
 
-@app.post("/api/analyze", response_model=AnalyzeResponse)
-async def analyze_conversation(request: AnalyzeRequest):
+async def decide_process(
+    request: AnalyzeRequest,
+    detection: Optional[Dict[str, Any]] = None
+) -> AnalyzeResponse:
     """
-    Analyze a customer conversation and generate recommendations.
+    Run the Router -> Rules part of the pipeline (steps 1-4) for one conversation.
     
-    1. Router detects process
-    2. Check for required info
-    3. If info missing -> return status: NEED_INFO
-    4. If info present -> evaluate rules -> Specialist Agent -> status: RECOMMENDATION
+    A returned status of RECOMMENDATION means the specialist agent still has to
+    run; `recommendation` is always None here. `detection` skips the router call
+    when the conversation was already classified (see analyze_batch).
+    
+    While a router call to Gemini is in flight, the rules engines of the most
+    common processes are loaded speculatively; the ones not needed are
+    cancelled. A detection already known (passed in, or from the router's
+    keywords and cache) only loads the detected process's engine.
     """
+    # Validate input
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="No messages provided")
+    
+    if not request.customer_context:
+        raise HTTPException(status_code=400, detail="No customer context provided")
+    
+    if detection is None:
+        detection = get_router_agent().peek_detection(request.messages)
+    prefetch = {} if detection is not None else {
+        name: asyncio.create_task(load_rules_engine_async(name))
+        for name, _ in _process_counts.most_common(SPECULATIVE_TOP_K)
+    }
     try:
-        # Validate input
-        if not request.messages:
-            raise HTTPException(status_code=400, detail="No messages provided")
-        
-        if not request.customer_context:
-            raise HTTPException(status_code=400, detail="No customer context provided")
-        
-        # Step 1: Detect process and extract data using router agent
-        router = get_router_agent()
-        detection = router.detect_process(request.messages)
-        
-        process_name = detection.get("process", "UNKNOWN")
-        confidence = detection.get("confidence", 0.0)
-        extracted_data = detection.get("extracted_data", {})
-        
-        # Unir contexto estático con datos extraídos dinámicamente
-        enriched_context = request.customer_context.copy()
-        for key, value in extracted_data.items():
-            current_val = enriched_context.get(key)
-            # Actualizamos si el valor extraído no es nulo y el actual está vacío o es nulo
-            if value is not None and (current_val is None or current_val == "" or current_val == "null"):
-                enriched_context[key] = value
-
-        # CASO ESPECIAL: Si es charla social (SmallTalk), no lanzamos error ni evaluamos reglas
-        if process_name == "SOCIAL":
-            return AnalyzeResponse(
-                status="SOCIAL",
-                process="SOCIAL",
-                confidence=confidence,
-                rules_decision={"status": "SOCIAL", "message": "Conversación social detectada"},
-                recommendation=None,
-                enriched_context=enriched_context
-            )
+        return await _detect_and_evaluate(request, prefetch, detection)
+    finally:
+        _discard_prefetch(prefetch.values())
 
-        if process_name == "UNKNOWN" or confidence < 0.3: # Bajamos umbral para charla
-             return AnalyzeResponse(
-                status="UNKNOWN",
-                process="UNKNOWN",
-                confidence=confidence,
-                rules_decision={"status": "UNKNOWN", "message": "Esperando solicitud de negocio..."},
-                recommendation=None,
-                enriched_context=enriched_context
-            )
-        
-        # Step 2: Load rules engine for detected process
-        try:
-            rules_engine = load_rules_engine(process_name)
-        except FileNotFoundError:
-            raise HTTPException(
-                status_code=404,
-                detail=f"Rules not found for process: {process_name}"
-            )
-        
-        # Step 3: Evaluate rules (ahora con el contexto enriquecido por el LLM)
-        rules_output = rules_engine.evaluate(enriched_context)
-        status = rules_output.get("status", "RECOMMENDATION")
-        
-        # Step 4: Branch based on status
-        if status == "NEED_INFO":
-            return AnalyzeResponse(
-                status="NEED_INFO",
-                process=process_name,
-                confidence=confidence,
-                rules_decision=rules_output,
-                recommendation=None,
-                enriched_context=enriched_context
-            )
-        
-        # Step 5: Generate recommendation using specialist agent
-        if process_name == "STOP_REPARTO":
-            agent = get_stop_reparto_agent()
-            recommendation = agent.generate_recommendation(
-                messages=request.messages,
-                customer_context=enriched_context,
-                rules_decision=rules_output
-            )
-        elif process_name == "AVISO_URGENTE":
-            agent = get_aviso_urgente_agent()
-            recommendation = agent.generate_recommendation(
-                messages=request.messages,
-                customer_context=enriched_context,
-                rules_decision=rules_output
-            )
+
+def _discard_prefetch(tasks) -> None:
+    """Cancel speculative rules loads that turned out not to be needed."""
+    for task in tasks:
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            task.exception()  # Mark as retrieved to avoid "never retrieved" warnings
+
+
+# Context values the router is allowed to overwrite
+_EMPTY_VALUES = (None, "", "null")
+
+
+async def _detect_and_evaluate(
+    request: AnalyzeRequest,
+    prefetch: Dict[str, asyncio.Task],
+    detection: Optional[Dict[str, Any]] = None
+) -> AnalyzeResponse:
+    """Pipeline steps 1-4 (see analyze_conversation)."""
+    # Step 1: Detect process and extract data using router agent
+    if detection is None:
+        detection = await detect_process(request.messages)
+    
+    process_name = detection.get("process", "UNKNOWN")
+    confidence = detection.get("confidence", 0.0)
+    extracted_data = detection.get("extracted_data", {})
+    
+    # Unir contexto estático con datos extraídos dinámicamente:
+    # actualizamos si el valor extraído no es nulo y el actual está vacío o es nulo
+    customer_context = request.customer_context
+    enriched_context = {
+        **customer_context,
+        **{
+            key: value for key, value in extracted_data.items()
+            if value is not None and customer_context.get(key) in _EMPTY_VALUES
+        }
+    }
+
+    # CASO ESPECIAL: Si es charla social (SmallTalk), no lanzamos error ni evaluamos reglas
+    if process_name == "SOCIAL":
+        return _short_circuit(_SOCIAL_DECISION, confidence, enriched_context)
+
+    if process_name == "UNKNOWN" or confidence < 0.3: # Bajamos umbral para charla
+        return _short_circuit(_UNKNOWN_DECISION, confidence, enriched_context)
+    
+    # Step 2: Load rules engine for detected process (prefetched if speculated)
+    try:
+        prefetch_task = prefetch.pop(process_name, None)
+        if prefetch_task is not None:
+            rules_engine = await prefetch_task
         else:
-            raise HTTPException(
-                status_code=501,
-                detail=f"Specialist agent not implemented for process: {process_name}"
-            )
-        
-        # Return complete RECOMMENDATION analysis
+            rules_engine = await load_rules_engine_async(process_name)
+    except FileNotFoundError:
+        raise HTTPException(
+            status_code=404,
+            detail=f"Rules not found for process: {process_name}"
+        )
+    _process_counts[process_name] += 1
+    
+    # Step 3: Evaluate rules (ahora con el contexto enriquecido por el LLM)
+    rules_output = await run_in_threadpool(rules_engine.evaluate, enriched_context)
+    status = rules_output.get("status", "RECOMMENDATION")
+    
+    # Step 4: Branch based on status
+    if status == "NEED_INFO":
         return AnalyzeResponse(
-            status="RECOMMENDATION",
+            status="NEED_INFO",
             process=process_name,
             confidence=confidence,
             rules_decision=rules_output,
-            recommendation=recommendation,
+            recommendation=None,
             enriched_context=enriched_context
         )
     
+    # Specialist agent still pending (step 5)
+    return AnalyzeResponse(
+        status="RECOMMENDATION",
+        process=process_name,
+        confidence=confidence,
+        rules_decision=rules_output,
+        recommendation=None,
+        enriched_context=enriched_context
+    )
+
+
+# rules_decision of the conversations that never reach the rules engine
+_SOCIAL_DECISION = {"status": "SOCIAL", "message": "Conversación social detectada"}
+_UNKNOWN_DECISION = {"status": "UNKNOWN", "message": "Esperando solicitud de negocio..."}
+
+
+def _short_circuit(
+    rules_decision: Dict[str, Any],
+    confidence: float,
+    enriched_context: Dict[str, Any]
+) -> AnalyzeResponse:
+    """SOCIAL / UNKNOWN response, built from a template without re-validating it."""
+    status = rules_decision["status"]
+    return AnalyzeResponse.model_construct(
+        status=status,
+        process=status,
+        confidence=float(confidence),
+        rules_decision=dict(rules_decision),
+        recommendation=None,
+        enriched_context=enriched_context
+    )
+
+
+def get_specialist_agent(process_name: str):
+    """Get the specialist agent for a process (raises 501 if there is none)."""
+    if process_name == "STOP_REPARTO":
+        return get_stop_reparto_agent()
+    if process_name == "AVISO_URGENTE":
+        return get_aviso_urgente_agent()
+    raise HTTPException(
+        status_code=501,
+        detail=f"Specialist agent not implemented for process: {process_name}"
+    )
+
+
+async def run_pipeline(
+    request: AnalyzeRequest,
+    detection: Optional[Dict[str, Any]] = None
+) -> AnalyzeResponse:
+    """Run the full Router -> Rules -> Specialist pipeline for one conversation."""
+    decision = await decide_process(request, detection)
+    if decision.status != "RECOMMENDATION":
+        return decision
+    return await _recommend(request, decision)
+
+
+async def _recommend(request: AnalyzeRequest, decision: AnalyzeResponse) -> AnalyzeResponse:
+    """Pipeline step 5: fill in the specialist recommendation."""
+    agent = get_specialist_agent(decision.process)
+    recommendation = await agent.agenerate_recommendation(
+        messages=request.messages,
+        customer_context=decision.enriched_context,
+        rules_decision=decision.rules_decision
+    )
+    
+    # Return complete RECOMMENDATION analysis
+    return decision.model_copy(update={"recommendation": recommendation})
+
+
+def _decisions_by_motivo(rules_engine, customer_context: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """STOP_REPARTO rules decision for each motivo the router could extract."""
+    current = customer_context.get("motivo")
+    motivos = agents.MOTIVOS if current in _EMPTY_VALUES else (current,)
+    decisions = {}
+    for motivo in motivos:
+        output = rules_engine.evaluate({**customer_context, "motivo": motivo})
+        if output.get("status", "RECOMMENDATION") == "RECOMMENDATION":
+            decisions[motivo] = output
+    return decisions
+
+
+async def run_fused_pipeline(request: AnalyzeRequest) -> AnalyzeResponse:
+    """
+    Same result as run_pipeline, but detects the process and writes the
+    STOP_REPARTO recommendation in a single Gemini call.
+    
+    The fused recommendation is only kept if the router part is confident and
+    the rules decision it was written for is the one the rules engine reaches
+    with the extracted data; otherwise the regular specialist runs, reusing the
+    fused detection so the router is not called twice.
+    """
+    if not request.messages:
+        raise HTTPException(status_code=400, detail="No messages provided")
+    if not request.customer_context:
+        raise HTTPException(status_code=400, detail="No customer context provided")
+    
+    # Keywords / cache already give the detection for free: one call either way
+    detection = get_router_agent().peek_detection(request.messages)
+    if detection is not None:
+        return await run_pipeline(request, detection)
+    
+    rules_engine = await load_rules_engine_async("STOP_REPARTO")
+    decisions = await run_in_threadpool(_decisions_by_motivo, rules_engine, request.customer_context)
+    if not decisions:
+        # Rules will ask for missing info whatever the motivo: nothing to write
+        return await run_pipeline(request)
+    
+    fused = await get_fused_stop_reparto_agent().adetect_and_recommend(
+        request.messages, request.customer_context, decisions
+    )
+    if fused is None:
+        return await run_pipeline(request)
+    
+    recommendation = fused.pop("recommendation", None)
+    fused.setdefault("extracted_data", {})
+    decision = await decide_process(request, fused)
+    if decision.status != "RECOMMENDATION":
+        return decision
+    if (
+        recommendation
+        and decision.process == "STOP_REPARTO"
+        and decision.confidence >= FUSED_MIN_CONFIDENCE
+        and decision.rules_decision == decisions.get(decision.enriched_context.get("motivo"))
+    ):
+        return decision.model_copy(update={"recommendation": recommendation})
+    return await _recommend(request, decision)
+
+
+def _internal_error() -> JSONResponse:
+    """
+    Build the 500 response for unexpected pipeline errors.
+    
+    The exception and its traceback are only logged server-side (Vercel console);
+    the client gets a generic message.
+    """
+    logger.exception("analyze failed")
+    return JSONResponse(
+        status_code=500,
+        content={"detail": "Internal Server Error"}
+    )
+
+
+@app.post("/api/analyze", response_model=AnalyzeResponse, openapi_extra=ANALYZE_REQUEST_OPENAPI)
+async def analyze_conversation(request: AnalyzeRequest = Depends(parse_analyze_request)):
+    """
+    Analyze a customer conversation and generate recommendations.
+    
+    1. Router detects process
+    2. Check for required info
+    3. If info missing -> return status: NEED_INFO
+    4. If info present -> evaluate rules -> Specialist Agent -> status: RECOMMENDATION
+    """
+    try:
+        result = await run_pipeline(request)
+        if result.status in ("SOCIAL", "UNKNOWN"):
+            # Template response: skip the response_model validation round-trip
+            return ORJSONResponse(result.model_dump())
+        return result
     except HTTPException as he:
         # Re-raise HTTP exceptions so FastAPI handles them (returns JSON)
         raise he
-    except Exception as e:
-        import traceback
-        error_msg = f"Internal Server Error: {str(e)}\n{traceback.format_exc()}"
-        print(error_msg) # Log to Vercel console
-        return JSONResponse(
-            status_code=500,
-            content={
-                "detail": str(e),
-                "trace": traceback.format_exc()
-            }
-        )
+    except Exception:
+        return _internal_error()
 
 
-@app.get("/api/processes")
-async def list_processes():
-    """List available processes."""
+@app.post("/api/analyze_batch", response_model=List[AnalyzeResponse])
+async def analyze_batch(requests: List[AnalyzeRequest]):
+    """
+    Analyze several conversations concurrently.
+    
+    The router classifies all conversations in a single Gemini call; then at
+    most BATCH_CONCURRENCY pipelines run at once to stay within Gemini rate limits.
+    """
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def bounded(request: AnalyzeRequest, detection: Dict[str, Any]) -> AnalyzeResponse:
+        async with semaphore:
+            return await run_pipeline(request, detection)
+
+    try:
+        # Validate up front so no Gemini call is made for an invalid batch
+        for request in requests:
+            if not request.messages:
+                raise HTTPException(status_code=400, detail="No messages provided")
+            if not request.customer_context:
+                raise HTTPException(status_code=400, detail="No customer context provided")
+        
+        detections = await get_router_agent().adetect_process_batch([r.messages for r in requests])
+        return await asyncio.gather(*(bounded(r, d) for r, d in zip(requests, detections)))
+    except HTTPException as he:
+        raise he
+    except Exception:
+        return _internal_error()
+
+
+# Keep proxies from buffering the stream (tokens must reach the client as generated)
+_SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def _sse(event: str, data: Any) -> str:
+    """Format one Server-Sent Event frame."""
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+async def _stream_recommendation(request: AnalyzeRequest, decision: AnalyzeResponse, agent):
+    """Forward the specialist's partial output, then the final AnalyzeResponse."""
+    yield _sse("status", decision.model_dump())
+    recommendation = None
+    async for update in agent.astream_recommendation(
+        messages=request.messages,
+        customer_context=decision.enriched_context,
+        rules_decision=decision.rules_decision
+    ):
+        if "recommendation" in update:
+            recommendation = update["recommendation"]
+        else:
+            yield _sse("token", update)
+    decision = decision.model_copy(update={"recommendation": recommendation})
+    yield _sse("result", decision.model_dump())
+
+
+@app.post("/api/analyze/stream", openapi_extra=ANALYZE_REQUEST_OPENAPI)
+async def analyze_conversation_stream(request: AnalyzeRequest = Depends(parse_analyze_request)):
+    """
+    Streaming version of /api/analyze (text/event-stream).
+    
+    Events:
+    - status: router + rules result, sent before the specialist starts
+    - token:  {"field", "delta"} text appended to titulo / speech_sugerido,
+              sent as the specialist generates it
+    - result: the final AnalyzeResponse (the only event when no specialist runs)
+    """
+    try:
+        decision = await decide_process(request)
+        if decision.status != "RECOMMENDATION":
+            return StreamingResponse(
+                iter([_sse("result", decision.model_dump())]),
+                media_type="text/event-stream",
+                headers=_SSE_HEADERS
+            )
+        agent = get_specialist_agent(decision.process)
+    except HTTPException as he:
+        raise he
+    except Exception:
+        return _internal_error()
+    
+    return StreamingResponse(
+        _stream_recommendation(request, decision, agent),
+        media_type="text/event-stream",
+        headers=_SSE_HEADERS
+    )
+
+
+def _scan_processes() -> Dict[str, Any]:
+    """List the process folders deployed next to this file."""
     base_path = Path(__file__).parent
     processes = []
     
@@ -267,6 +636,16 @@ async def list_processes():
     return {"processes": processes}
 
 
+@app.get("/api/processes")
+async def list_processes():
+    """List available processes (the folder scan is cached for a minute)."""
+    processes = _processes_cache.get("processes")
+    if processes is None:
+        processes = await run_in_threadpool(_scan_processes)
+        _processes_cache.set("processes", processes)
+    return processes
+
+
 class TTSRequest(BaseModel):
     text: str
     voice_id: str = "JBFqnCBsd6RMkjVDRZzb" # Default voice if not specified
@@ -276,7 +655,7 @@ class TTSRequest(BaseModel):
 async def text_to_speech_proxy(request: TTSRequest):
     """
     Proxy endpoint for ElevenLabs Text-to-Speech to keep API key secure.
-    Returns audio/mpeg stream.
+    Returns audio/mpeg stream (chunks are forwarded as they are synthesized).
     """
     import httpx
     
@@ -284,7 +663,7 @@ async def text_to_speech_proxy(request: TTSRequest):
     if not api_key:
         raise HTTPException(status_code=500, detail="ElevenLabs API Key not configured")
 
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{request.voice_id}"
+    url = f"https://api.elevenlabs.io/v1/text-to-speech/{request.voice_id}/stream"
     
     headers = {
         "Accept": "audio/mpeg",
@@ -301,32 +680,44 @@ async def text_to_speech_proxy(request: TTSRequest):
         }
     }
 
-    # We need a synchronous-looking response for streaming, or just return content for simplicity in POC.
-    # For a simple widget, returning bytes is fine.
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=data, headers=headers, timeout=30.0)
-            response.raise_for_status()
-            
-            from fastapi.responses import Response
-            return Response(content=response.content, media_type="audio/mpeg")
-            
-        except httpx.HTTPError as e:
-            raise HTTPException(status_code=502, detail=f"ElevenLabs Error: {str(e)}")
+    # Forward audio chunks as ElevenLabs produces them; the upstream response
+    # stays open until the last chunk is sent and is closed by the background task
+    client = agents.get_http_client()
+    upstream_request = client.build_request("POST", url, json=data, headers=headers, timeout=30.0)
+    try:
+        response = await client.send(upstream_request, stream=True)
+    except httpx.HTTPError as e:
+        raise HTTPException(status_code=502, detail=f"ElevenLabs Error: {str(e)}")
+    
+    if response.is_error:
+        await response.aread()
+        await response.aclose()
+        raise HTTPException(status_code=502, detail=f"ElevenLabs Error: {response.status_code} {response.text}")
+    
+    return StreamingResponse(
+        response.aiter_bytes(),
+        media_type="audio/mpeg",
+        background=BackgroundTask(response.aclose)
+    )
 
 
 if __name__ == "__main__":
     import uvicorn
     
+    logging.basicConfig(level=logging.INFO)
+    
     # Check for API key
     if not os.getenv("GOOGLE_API_KEY"):
-        print("WARNING: GOOGLE_API_KEY not set in environment")
-        print("Please create a .env file with your API key")
+        logger.warning("GOOGLE_API_KEY not set in environment. Please create a .env file with your API key")
     
-    # Run server
+    # Run server: UVICORN_RELOAD=1 for local development (single process),
+    # otherwise WEB_CONCURRENCY workers. uvicorn picks uvloop and httptools
+    # (see requirements.txt) automatically when they are installed
+    reload = os.getenv("UVICORN_RELOAD", "0") == "1"
     uvicorn.run(
         "index:app",
         host="0.0.0.0",
         port=8000,
-        reload=True
+        reload=reload,
+        workers=None if reload else int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
     )
@@ -1,4 +1,7 @@
 
+import asyncio
+import secrets
+from contextlib import asynccontextmanager
 from fastmcp import FastMCP
 from fastapi import FastAPI
 from fastapi.responses import RedirectResponse
@@ -6,6 +9,8 @@ import uvicorn
 import os
 import httpx
 
+from elevenlabs_client import close_client, get_client, write_mp3
+
 # 1. Create the FastMCP server
 mcp = FastMCP("ElevenLabs Service")
 
@@ -36,19 +41,16 @@ async def text_to_speech(text: str, voice_id: str = "JBFqnCBsd6RMkjVDRZzb") -> s
         }
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=data, headers=headers, timeout=30.0)
-            response.raise_for_status()
-        except httpx.HTTPError as e:
-            return f"Error contacting ElevenLabs: {str(e)}"
+    try:
+        response = await get_client().post(url, json=data, headers=headers, timeout=30.0)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        return f"Error contacting ElevenLabs: {str(e)}"
 
     output_dir = os.path.join(os.getcwd(), "static", "audio")
-    os.makedirs(output_dir, exist_ok=True)
-    filename = f"speech_{os.urandom(4).hex()}.mp3"
+    filename = f"speech_{secrets.token_hex(4)}.mp3"
     filepath = os.path.join(output_dir, filename)
-    with open(filepath, "wb") as f:
-        f.write(response.content)
+    await asyncio.to_thread(write_mp3, filepath, response.content)
     return f"Audio generated successfully: {filepath}"
 
 @mcp.tool()
@@ -58,15 +60,22 @@ async def get_voices() -> str:
     if not api_key: return "Error: ELEVENLABS_API_KEY not set."
     url = "https://api.elevenlabs.io/v1/voices"
     headers = {"xi-api-key": api_key}
-    async with httpx.AsyncClient() as client:
-        response = await client.get(url, headers=headers)
-        return response.text
+    response = await get_client().get(url, headers=headers)
+    return response.text
 
 # 2. Extract the FastAPI app and wrap it
 # In newer FastMCP, we can get the app
 mcp_app = mcp.fastapi_app()
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared ElevenLabs client on startup and close it on shutdown."""
+    get_client()
+    yield
+    await close_client()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Mount the MCP app at / (root) or /sse
 # To fix ElevenLabs hitting /, we can redirect or mount it directly
@@ -1,30 +1,132 @@
 
 import os
-import httpx
-import json
 import uuid
 import asyncio
-from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import uvicorn
-from pathlib import Path
+import orjson
 
-# Import logic from the project
-# We need to add the parent directory to path since we are in 'api' usually
-import sys
-sys.path.append(os.getcwd())
+# Import logic from the project (run from api/ or as the api.mcp_manual module)
+try:
+    from index import run_fused_pipeline, decide_process, get_specialist_agent, AnalyzeRequest
+except ImportError:
+    from api.index import run_fused_pipeline, decide_process, get_specialist_agent, AnalyzeRequest
 
-from index import analyze_conversation, AnalyzeRequest
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Python 3.12+: run each new task's synchronous prelude immediately instead
+    # of waiting for the next loop iteration
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    yield
 
-app = FastAPI()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
+# Explicit origins (comma separated); preflights are cached by the browser for a day
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=os.getenv("ALLOWED_ORIGINS", "https://claude.ai").split(","),
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type"],
+    max_age=86400,
 )
 
+# Tools exposed through tools/list
+TOOLS = [
+    {
+        "name": "analyze_customer_case",
+        "description": "Analiza una conversación con un cliente de Aquaservice (Stop Reparto o Aviso Urgente) y devuelve la mejor recomendación basada en las reglas oficiales.",
+        "inputSchema": {
+            "type": "object",
+            "properties": {
+                "messages": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Lista de mensajes recientes del cliente"
+                },
+                "plan": {
+                    "type": "string", 
+                    "enum": ["Ahorro", "Planocho"],
+                    "description": "Plan contratado por el cliente"
+                },
+                "scoring": {
+                    "type": "number",
+                    "description": "Puntuación de fidelidad del cliente (1-5)"
+                },
+                "canal": {
+                    "type": "string",
+                    "enum": ["Telefono", "Chat"],
+                    "description": "Canal de atención"
+                }
+            },
+            "required": ["messages"]
+        }
+    }
+]
+
+
+def _tool_result(msg_id, text: str, is_error: bool = False) -> dict:
+    """JSON-RPC response for a tools/call request."""
+    result = {"content": [{"type": "text", "text": text}]}
+    if is_error:
+        result["isError"] = True
+    return {"jsonrpc": "2.0", "id": msg_id, "result": result}
+
+
+def _format_case(result) -> str:
+    """Render an AnalyzeResponse as the text returned to the MCP client."""
+    response_text = f"PROCESO DETECTADO: {result.process}\n\n"
+    if result.recommendation:
+        response_text += f"TÍTULO: {result.recommendation['titulo']}\n"
+        response_text += f"RECOMENDACIÓN:\n{result.recommendation['speech_sugerido']}\n\n"
+        response_text += f"SIGUIENTE PASO CRM: {result.recommendation.get('siguiente_paso', '')}"
+    else:
+        response_text += "No se pudo generar una recomendación completa. "
+        if result.rules_decision and "message" in result.rules_decision:
+            response_text += result.rules_decision["message"]
+    return response_text
+
+
+async def _stream_case(msg_id, progress_token, req: AnalyzeRequest):
+    """
+    JSON lines for a tools/call that asked for progress: one notifications/progress
+    per step and per chunk of speech_sugerido, then the tools/call result.
+    """
+    progress = 0
+
+    def notify(message: str) -> bytes:
+        nonlocal progress
+        progress += 1
+        return orjson.dumps({
+            "jsonrpc": "2.0",
+            "method": "notifications/progress",
+            "params": {"progressToken": progress_token, "progress": progress, "message": message}
+        }) + b"\n"
+
+    try:
+        decision = await decide_process(req)
+        yield notify(f"PROCESO DETECTADO: {decision.process}")
+        if decision.status == "RECOMMENDATION":
+            agent = get_specialist_agent(decision.process)
+            recommendation = None
+            async for update in agent.astream_recommendation(
+                messages=req.messages,
+                customer_context=decision.enriched_context,
+                rules_decision=decision.rules_decision
+            ):
+                if "recommendation" in update:
+                    recommendation = update["recommendation"]
+                elif update["field"] == "speech_sugerido":
+                    yield notify(update["delta"])
+            decision = decision.model_copy(update={"recommendation": recommendation})
+        yield orjson.dumps(_tool_result(msg_id, _format_case(decision))) + b"\n"
+    except Exception as e:
+        yield orjson.dumps(_tool_result(msg_id, f"Error procesando el caso: {str(e)}", is_error=True)) + b"\n"
+
+
 @app.get("/")
 async def root():
     return {"status": "ok", "mcp_endpoint": "/sse"}
@@ -32,13 +134,13 @@ async def root():
 @app.get("/sse")
 async def sse_endpoint(request: Request):
     async def event_generator():
-        session_id = str(uuid.uuid4()).replace("-", "")
+        session_id = uuid.uuid4().hex
         # The 'endpoint' event tells the client where to send POST messages
         yield f"event: endpoint\ndata: /messages/{session_id}\n\n"
         
+        # StreamingResponse listens for the client disconnect itself and
+        # cancels this generator right away, so there is nothing to poll
         while True:
-            if await request.is_disconnected():
-                break
             yield ":\n\n"
             await asyncio.sleep(15)
 
@@ -53,7 +155,7 @@ async def handle_messages(session_id: str, request: Request):
     
     # Standard MCP Handshake
     if method == "initialize":
-        return {
+        return ORJSONResponse({
             "jsonrpc": "2.0",
             "id": msg_id,
             "result": {
@@ -67,50 +169,17 @@ async def handle_messages(session_id: str, request: Request):
                     "version": "1.1.0"
                 }
             }
-        }
+        })
     
+    # Notifications expect no JSON-RPC response: answer without a body
     if method == "notifications/initialized":
-        return None
+        return Response(status_code=204)
+    if method and method.startswith("notifications/"):
+        return Response(status_code=202)
 
     # Tools List: Exposing the "Knowledge" of the project
     if method == "tools/list":
-        return {
-            "jsonrpc": "2.0",
-            "id": msg_id,
-            "result": {
-                "tools": [
-                    {
-                        "name": "analyze_customer_case",
-                        "description": "Analiza una conversación con un cliente de Aquaservice (Stop Reparto o Aviso Urgente) y devuelve la mejor recomendación basada en las reglas oficiales.",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "messages": {
-                                    "type": "array",
-                                    "items": {"type": "string"},
-                                    "description": "Lista de mensajes recientes del cliente"
-                                },
-                                "plan": {
-                                    "type": "string", 
-                                    "enum": ["Ahorro", "Planocho"],
-                                    "description": "Plan contratado por el cliente"
-                                },
-                                "scoring": {
-                                    "type": "number",
-                                    "description": "Puntuación de fidelidad del cliente (1-5)"
-                                },
-                                "canal": {
-                                    "type": "string",
-                                    "enum": ["Telefono", "Chat"],
-                                    "description": "Canal de atención"
-                                }
-                            },
-                            "required": ["messages"]
-                        }
-                    }
-                ]
-            }
-        }
+        return ORJSONResponse({"jsonrpc": "2.0", "id": msg_id, "result": {"tools": TOOLS}})
 
     # Tool Execution
     if method == "tools/call":
@@ -134,40 +203,33 @@ async def handle_messages(session_id: str, request: Request):
             
             try:
                 # We mock the AnalyzeRequest to reuse the logic in index.py
-                from pydantic import ValidationError
                 req = AnalyzeRequest(messages=messages, customer_context=context)
-                result = await analyze_conversation(req)
                 
-                # Format response for MCP
-                response_text = f"PROCESO DETECTADO: {result.process}\n\n"
-                if result.recommendation:
-                    response_text += f"TÍTULO: {result.recommendation['titulo']}\n"
-                    response_text += f"RECOMENDACIÓN:\n{result.recommendation['speech_sugerido']}\n\n"
-                    response_text += f"SIGUIENTE PASO CRM: {result.recommendation['siguiente_paso']}"
-                else:
-                    response_text += "No se pudo generar una recomendación completa. "
-                    if result.rules_decision and "message" in result.rules_decision:
-                        response_text += result.rules_decision["message"]
+                # The client asked for progress: stream the speech as it is generated
+                progress_token = (params.get("_meta") or {}).get("progressToken")
+                if progress_token is not None:
+                    return StreamingResponse(
+                        _stream_case(msg_id, progress_token, req),
+                        media_type="application/x-ndjson"
+                    )
                 
-                return {
-                    "jsonrpc": "2.0",
-                    "id": msg_id,
-                    "result": {
-                        "content": [{"type": "text", "text": response_text}]
-                    }
-                }
+                result = await run_fused_pipeline(req)
+                return ORJSONResponse(_tool_result(msg_id, _format_case(result)))
             except Exception as e:
-                return {
-                    "jsonrpc": "2.0",
-                    "id": msg_id,
-                    "result": {
-                        "content": [{"type": "text", "text": f"Error procesando el caso: {str(e)}"}],
-                        "isError": True
-                    }
-                }
+                return ORJSONResponse(_tool_result(msg_id, f"Error procesando el caso: {str(e)}", is_error=True))
 
     # Default fallback
-    return {"jsonrpc": "2.0", "id": msg_id, "result": {}}
+    return ORJSONResponse({"jsonrpc": "2.0", "id": msg_id, "result": {}})
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Handlers keep no per-session state, so any worker can serve any request.
+    # uvicorn picks uvloop and httptools automatically when they are installed
+    # (falling back to asyncio/h11 elsewhere). Equivalent under gunicorn:
+    #   gunicorn mcp_manual:app -k uvicorn.workers.UvicornWorker -w ${UVICORN_WORKERS:-4} --bind 0.0.0.0:8000
+    uvicorn.run(
+        "mcp_manual:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=int(os.getenv("UVICORN_WORKERS", "4")),
+        log_level="warning"
+    )
@@ -1,8 +1,12 @@
 
+import asyncio
+import secrets
 from fastmcp import FastMCP
 import httpx
 import os
 
+from elevenlabs_client import get_client, write_mp3
+
 # Initialize FastMCP server
 # This creates a FastAPI app internally that can be served via SSE
 mcp = FastMCP("ElevenLabs Service")
@@ -34,23 +38,18 @@ async def text_to_speech(text: str, voice_id: str = "JBFqnCBsd6RMkjVDRZzb") -> s
         }
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=data, headers=headers, timeout=30.0)
-            response.raise_for_status()
-        except httpx.HTTPError as e:
-            return f"Error contacting ElevenLabs: {str(e)}"
+    try:
+        response = await get_client().post(url, json=data, headers=headers, timeout=30.0)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        return f"Error contacting ElevenLabs: {str(e)}"
 
     # Save audio file to a static directory
     output_dir = os.path.join(os.getcwd(), "static", "audio")
-    os.makedirs(output_dir, exist_ok=True)
-    
-    filename = f"speech_{os.urandom(4).hex()}.mp3"
+    filename = f"speech_{secrets.token_hex(4)}.mp3"
     filepath = os.path.join(output_dir, filename)
-    
-    with open(filepath, "wb") as f:
-        f.write(response.content)
-        
+    await asyncio.to_thread(write_mp3, filepath, response.content)
+
     return f"Audio generated successfully: {filepath}"
 
 @mcp.tool()
@@ -65,13 +64,12 @@ async def get_voices() -> str:
     url = "https://api.elevenlabs.io/v1/voices"
     headers = {"xi-api-key": api_key}
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, headers=headers, timeout=10.0)
-            response.raise_for_status()
-        except httpx.HTTPError as e:
-            return f"Error contacting ElevenLabs: {str(e)}"
-            
+    try:
+        response = await get_client().get(url, headers=headers, timeout=10.0)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        return f"Error contacting ElevenLabs: {str(e)}"
+
     return response.text
 
 if __name__ == "__main__":
@@ -1,22 +1,37 @@
-
-import os
-import httpx
-from mcp.server.fastapi import Iceberg # Wait, checking correct import
+import asyncio
 import os
-import httpx
-from fastapi import FastAPI
+import secrets
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import ORJSONResponse
 from mcp.server import Server
 from mcp.server.sse import SseServerTransport
 from mcp.types import Tool, TextContent
 from starlette.middleware.cors import CORSMiddleware
 
+from elevenlabs_client import close_client, get_client, write_mp3
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open the shared ElevenLabs client on startup and close it on shutdown."""
+    # Python 3.12+: run each new task's synchronous prelude immediately instead
+    # of waiting for the next loop iteration
+    if hasattr(asyncio, "eager_task_factory"):
+        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
+    get_client()
+    yield
+    await close_client()
+
+
 # Initialize MCP Server
-app = FastAPI(title="ElevenLabs MCP Server")
+app = FastAPI(title="ElevenLabs MCP Server", lifespan=lifespan, default_response_class=ORJSONResponse)
+# Explicit origins (comma separated); preflights are cached by the browser for a day
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=["*"],
-    allow_methods=["*"],
-    allow_headers=["*"],
+    allow_origins=os.getenv("ALLOWED_ORIGINS", "https://claude.ai").split(","),
+    allow_methods=["GET", "POST"],
+    allow_headers=["content-type"],
+    max_age=86400,
 )
 
 server = Server("ElevenLabs Service")
@@ -54,9 +69,8 @@ async def handle_call_tool(name: str, arguments: dict | None) -> list[TextConten
     if name == "get_voices":
         url = "https://api.elevenlabs.io/v1/voices"
         headers = {"xi-api-key": api_key}
-        async with httpx.AsyncClient() as client:
-            resp = await client.get(url, headers=headers)
-            return [TextContent(type="text", text=resp.text)]
+        resp = await get_client().get(url, headers=headers)
+        return [TextContent(type="text", text=resp.text)]
 
     elif name == "text_to_speech":
         text = arguments.get("text")
@@ -65,30 +79,27 @@ async def handle_call_tool(name: str, arguments: dict | None) -> list[TextConten
         headers = {"Accept": "audio/mpeg", "Content-Type": "application/json", "xi-api-key": api_key}
         data = {"text": text, "model_id": "eleven_monolingual_v1"}
         
-        async with httpx.AsyncClient() as client:
-            resp = await client.post(url, json=data, headers=headers)
-            if resp.status_code != 200:
-                return [TextContent(type="text", text=f"Error: {resp.text}")]
-            
-            output_dir = os.path.join(os.getcwd(), "static", "audio")
-            os.makedirs(output_dir, exist_ok=True)
-            filename = f"speech_{os.urandom(4).hex()}.mp3"
-            filepath = os.path.join(output_dir, filename)
-            with open(filepath, "wb") as f:
-                f.write(resp.content)
-            return [TextContent(type="text", text=f"Audio generated: {filepath}")]
+        resp = await get_client().post(url, json=data, headers=headers)
+        if resp.status_code != 200:
+            return [TextContent(type="text", text=f"Error: {resp.text}")]
+        
+        output_dir = os.path.join(os.getcwd(), "static", "audio")
+        filename = f"speech_{secrets.token_hex(4)}.mp3"
+        filepath = os.path.join(output_dir, filename)
+        await asyncio.to_thread(write_mp3, filepath, resp.content)
+        return [TextContent(type="text", text=f"Audio generated: {filepath}")]
     
     return [TextContent(type="text", text=f"Unknown tool: {name}")]
 
 sse = SseServerTransport("/messages")
 
 @app.get("/sse")
-async def handle_sse(request):
+async def handle_sse(request: Request):
     async with sse.connect_sse(request.scope, request.receive, request.send) as (read_stream, write_stream):
         await server.run(read_stream, write_stream, server.create_initialization_options())
 
 @app.post("/messages")
-async def handle_messages(request):
+async def handle_messages(request: Request):
     await sse.handle_post_message(request.scope, request.receive, request.send)
 
 # Add a redirect from / to /sse to handle tracers
@@ -98,4 +109,7 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Single worker on purpose: SseServerTransport keeps sessions in memory, so
+    # the POST /messages for a session must reach the process holding its /sse.
+    # uvloop and httptools are used automatically when installed
+    uvicorn.run(app, host="0.0.0.0", port=8000, log_level="warning")
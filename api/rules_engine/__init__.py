@@ -1,3 +1,3 @@
-from .evaluator import RulesEngine, load_rules_engine
+from .evaluator import RulesEngine, load_rules_engine, load_rules_engine_async
 
-__all__ = ["RulesEngine", "load_rules_engine"]
+__all__ = ["RulesEngine", "load_rules_engine", "load_rules_engine_async"]
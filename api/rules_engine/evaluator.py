@@ -5,85 +5,179 @@ Evaluates business rules independently of LLM logic.
 Rules are loaded from JSON files and evaluated based on customer context.
 """
 
-import json
-from typing import Dict, Any, List, Optional
+import asyncio
+import os
+from dataclasses import dataclass
+from typing import Callable, Dict, Any, FrozenSet, Optional, Sequence, Tuple
 from pathlib import Path
+import orjson
+
+
+Predicate = Callable[[Dict[str, Any]], bool]
+
+# Required field values considered missing (a tuple rather than a set so
+# unhashable context values can still be checked)
+_MISSING_VALUES = (None, "", "desconocido", "null")
+
+# Marks rules whose 'then' has no allow_stop_0euros flag
+_NO_FLAG = object()
+
+# Rule sets with at least this many rules are prefiltered by their equality
+# conditions (for fewer rules a plain scan is cheaper than the set operations)
+PREFILTER_MIN_RULES = 32
+
+# field -> (required value -> rule positions, positions not constraining the field)
+EqualityIndex = Dict[str, Tuple[Dict[Any, FrozenSet[int]], FrozenSet[int]]]
+
+
+def _compile_condition(field: str, condition: Any) -> Predicate:
+    """
+    Build the check for a single `when` condition.
+    
+    Supports:
+    - Direct equality: "plan": "Ahorro"
+    - Range checks: "scoring": {"min": 4}
+    - Max checks: "stops": {"max": 1}
+    
+    A missing (None) context value never matches.
+    
+    Args:
+        field: Context field the condition applies to
+        condition: The condition from the rule
+        
+    Returns:
+        Function of the customer context returning True if the condition matches
+    """
+    if not isinstance(condition, dict):
+        return lambda ctx: (value := ctx.get(field)) is not None and condition == value
+    
+    has_min, has_max = "min" in condition, "max" in condition
+    low, high = condition.get("min"), condition.get("max")
+    if has_min and has_max:
+        return lambda ctx: (value := ctx.get(field)) is not None and not (value < low or value > high)
+    if has_min:
+        return lambda ctx: (value := ctx.get(field)) is not None and not value < low
+    if has_max:
+        return lambda ctx: (value := ctx.get(field)) is not None and not value > high
+    return lambda ctx: ctx.get(field) is not None
+
+
+def _compile_rule(rule: Dict[str, Any]) -> Tuple[Predicate, ...]:
+    """
+    Checks for all conditions in a rule's 'when' (AND logic).
+    
+    Equality checks come first (otherwise in file order): they never raise, so
+    a rule failing one is rejected before any range comparison that could
+    raise TypeError on a mixed-type value, exactly as if the equality
+    prefilter had skipped it. Both evaluation paths then behave the same.
+    """
+    when = rule.get("when", {}).items()
+    return tuple(
+        _compile_condition(field, condition)
+        for field, condition in sorted(when, key=lambda item: isinstance(item[1], dict))
+    )
+
+
+@dataclass(frozen=True, slots=True)
+class CompiledRule:
+    """A rule from the JSON file, prepared once for evaluate()."""
+    rule: Dict[str, Any]
+    conditions: Tuple[Predicate, ...]
+    allow_stop_0euros: Any = _NO_FLAG
+
+    @classmethod
+    def from_rule(cls, rule: Dict[str, Any]) -> "CompiledRule":
+        return cls(
+            rule=rule,
+            conditions=_compile_rule(rule),
+            allow_stop_0euros=rule.get("then", {}).get("allow_stop_0euros", _NO_FLAG)
+        )
+
+
+def _build_equality_index(rules: Sequence["CompiledRule"]) -> EqualityIndex:
+    """
+    Index the rules by their equality conditions ("plan": "Ahorro").
+    
+    Only hashable, non-null values are indexed; rules with any other condition
+    on a field count as not constraining it, so they are never filtered out
+    by it and still go through their full checks.
+    """
+    by_field: Dict[str, Dict[Any, set]] = {}
+    for position, compiled in enumerate(rules):
+        for field, condition in compiled.rule.get("when", {}).items():
+            if condition is None or isinstance(condition, (dict, list)):
+                continue
+            by_field.setdefault(field, {}).setdefault(condition, set()).add(position)
+    
+    everything = frozenset(range(len(rules)))
+    index = {}
+    for field, by_value in by_field.items():
+        constrained = frozenset().union(*by_value.values())
+        index[field] = (
+            {value: frozenset(positions) for value, positions in by_value.items()},
+            everything - constrained
+        )
+    return index
 
 
 class RulesEngine:
     """Evaluates business rules deterministically based on customer context."""
     
-    def __init__(self, rules_path: str):
+    def __init__(self, rules_path: str, prefilter_min_rules: int = PREFILTER_MIN_RULES):
         """
         Initialize the rules engine with a rules JSON file.
         
         Args:
             rules_path: Path to the rules JSON file
+            prefilter_min_rules: Minimum number of rules for the equality prefilter
         """
         self.rules_path = Path(rules_path)
         self.rules_data = self._load_rules()
+        # Read-only views prepared once instead of on every evaluate() call
+        self._required_fields = tuple(self.rules_data.get("required_fields", []))
+        missing_info_behavior = self.rules_data.get("missing_info_behavior", {})
+        self._missing_status = missing_info_behavior.get("status", "NEED_INFO")
+        self._missing_questions = missing_info_behavior.get("questions", {})
+        # Highest priority first
+        self._rules = tuple(
+            CompiledRule.from_rule(rule)
+            for rule in sorted(
+                self.rules_data.get("rules", []),
+                key=lambda r: r.get("priority", 0),
+                reverse=True
+            )
+        )
+        # Without any flag to merge the first match settles the decision
+        self._has_mergeable_flags = any(
+            compiled.allow_stop_0euros is not _NO_FLAG for compiled in self._rules
+        )
+        self._equality_index: Optional[EqualityIndex] = (
+            _build_equality_index(self._rules) if len(self._rules) >= prefilter_min_rules else None
+        )
     
     def _load_rules(self) -> Dict[str, Any]:
         """Load rules from JSON file."""
-        with open(self.rules_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    
-    def _evaluate_condition(self, condition: Any, context_value: Any) -> bool:
-        """
-        Evaluate a single condition against a context value.
-        
-        Supports:
-        - Direct equality: "plan": "Ahorro"
-        - Range checks: "scoring": {"min": 4}
-        - Max checks: "stops": {"max": 1}
-        
-        Args:
-            condition: The condition from the rule
-            context_value: The actual value from customer context
-            
-        Returns:
-            True if condition matches, False otherwise
-        """
-        # Handle missing context value
-        if context_value is None:
-            return False
-        
-        # Handle simple equality
-        if not isinstance(condition, dict):
-            return condition == context_value
-        
-        # Handle range conditions
-        if "min" in condition:
-            if context_value < condition["min"]:
-                return False
-        
-        if "max" in condition:
-            if context_value > condition["max"]:
-                return False
-        
-        return True
+        return orjson.loads(self.rules_path.read_bytes())
     
-    def _evaluate_rule(self, rule: Dict[str, Any], customer_context: Dict[str, Any]) -> bool:
+    def _candidate_rules(self, customer_context: Dict[str, Any]) -> Sequence["CompiledRule"]:
         """
-        Evaluate if a rule's conditions match the customer context.
-        All conditions in 'when' must be satisfied (AND logic).
+        Rules (in priority order) not already ruled out by an equality condition.
         
-        Args:
-            rule: The rule to evaluate
-            customer_context: Customer context data
-            
-        Returns:
-            True if all conditions match, False otherwise
+        Context values that cannot be hashed skip the prefilter for their field.
         """
-        when_conditions = rule.get("when", {})
-        
-        for field, condition in when_conditions.items():
-            context_value = customer_context.get(field)
-            
-            if not self._evaluate_condition(condition, context_value):
-                return False
-        
-        return True
+        if self._equality_index is None:
+            return self._rules
+        allowed = None
+        for field, (by_value, unconstrained) in self._equality_index.items():
+            try:
+                positions = by_value.get(customer_context.get(field))
+            except TypeError:
+                continue
+            positions = unconstrained if positions is None else positions | unconstrained
+            allowed = positions if allowed is None else allowed & positions
+        if allowed is None:
+            return self._rules
+        return [self._rules[position] for position in sorted(allowed)]
     
     def evaluate(self, customer_context: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -100,35 +194,42 @@ class RulesEngine:
             Standardized decision dictionary with either status: NEED_INFO or RECOMMENDATION.
         """
         # Step 1: Check for required fields
-        required_fields = self.rules_data.get("required_fields", [])
-        missing_info_behavior = self.rules_data.get("missing_info_behavior", {})
-        
-        for field in required_fields:
-            value = customer_context.get(field)
-            # Consider None, empty string, or placeholder "desconocido" as missing
-            if value is None or value == "" or value == "desconocido" or value == "null":
-                return {
-                    "status": "NEED_INFO",
-                    "missing_field": field,
-                    "behavior": missing_info_behavior.get("status", "NEED_INFO"),
-                    "question_data": missing_info_behavior.get("questions", {}).get(field)
-                }
+        # Consider None, empty string, or placeholder "desconocido" as missing
+        missing_field = next(
+            (field for field in self._required_fields
+             if customer_context.get(field) in _MISSING_VALUES),
+            None
+        )
+        if missing_field is not None:
+            return {
+                "status": "NEED_INFO",
+                "missing_field": missing_field,
+                "behavior": self._missing_status,
+                "question_data": self._missing_questions.get(missing_field)
+            }
 
         # Step 2: All required info is present, evaluate rules
-        # Sort rules by priority (highest first)
-        rules = sorted(
-            self.rules_data.get("rules", []),
-            key=lambda r: r.get("priority", 0),
-            reverse=True
-        )
-        
-        # Collect all matching rules (we may need to merge results)
-        matched_rules = []
-        for rule in rules:
-            if self._evaluate_rule(rule, customer_context):
-                matched_rules.append(rule)
+        # (already sorted by priority, highest first)
+        # The highest priority match decides; flags are merged from every match
+        # (lowest priority last, so it wins)
+        primary_rule = None
+        allow_stop_0euros = _NO_FLAG
+        for compiled in self._candidate_rules(customer_context):
+            # Once the primary rule is known, only rules carrying a flag matter
+            if primary_rule is not None and compiled.allow_stop_0euros is _NO_FLAG:
+                continue
+            for check in compiled.conditions:
+                if not check(customer_context):
+                    break
+            else:
+                if primary_rule is None:
+                    primary_rule = compiled.rule
+                    if not self._has_mergeable_flags:
+                        break
+                if compiled.allow_stop_0euros is not _NO_FLAG:
+                    allow_stop_0euros = compiled.allow_stop_0euros
         
-        if not matched_rules:
+        if primary_rule is None:
             # No rules matched - return default "no match" decision
             return {
                 "status": "RECOMMENDATION",
@@ -139,31 +240,34 @@ class RulesEngine:
             }
         
         # Build consolidated decision from matched rules
-        # Start with highest priority rule
-        primary_rule = matched_rules[0]
         then_clause = primary_rule.get("then", {})
         
         decision = {
             "status": "RECOMMENDATION",
             "decision": then_clause.get("decision", "unknown"),
             "stop_allowed": then_clause.get("stop_allowed"),
-            "allowed_actions": then_clause.get("allowed_actions", []),
+            "allowed_actions": list(then_clause.get("allowed_actions", [])),
             "reason": then_clause.get("reason", "rule_" + primary_rule.get("id", "unknown"))
         }
         
         # Merge additional flags from other matching rules
-        for rule in matched_rules:
-            then_clause = rule.get("then", {})
-            if "allow_stop_0euros" in then_clause:
-                decision["allow_stop_0euros"] = then_clause["allow_stop_0euros"]
+        if allow_stop_0euros is not _NO_FLAG:
+            decision["allow_stop_0euros"] = allow_stop_0euros
         
         return decision
 
 
+# rules path -> (st_mtime_ns, engine) of the last load
+_RULES_CACHE: Dict[str, Tuple[int, RulesEngine]] = {}
+
+
 def load_rules_engine(process_name: str) -> RulesEngine:
     """
     Factory function to load a rules engine for a specific process.
     
+    Engines are cached per rules file and shared (read-only) by every request;
+    the file is only read again when its modification time changes.
+    
     Args:
         process_name: Name of the process (e.g., "STOP_REPARTO")
         
@@ -172,6 +276,28 @@ def load_rules_engine(process_name: str) -> RulesEngine:
     """
     # Construct path to rules file
     base_path = Path(__file__).parent.parent
-    rules_path = base_path / process_name.lower() / f"rules_{process_name.lower()}.json"
+    rules_path = str(base_path / process_name.lower() / f"rules_{process_name.lower()}.json")
     
-    return RulesEngine(str(rules_path))
+    mtime = os.stat(rules_path).st_mtime_ns
+    cached = _RULES_CACHE.get(rules_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    engine = RulesEngine(rules_path)
+    _RULES_CACHE[rules_path] = (mtime, engine)
+    return engine
+
+
+async def load_rules_engine_async(process_name: str) -> RulesEngine:
+    """
+    Async variant of load_rules_engine for request handlers.
+    
+    The mtime check (and, when the file changed, the read and parse) runs in
+    a worker thread so a slow disk never blocks the event loop.
+    
+    Args:
+        process_name: Name of the process (e.g., "STOP_REPARTO")
+        
+    Returns:
+        RulesEngine instance for the process
+    """
+    return await asyncio.to_thread(load_rules_engine, process_name)
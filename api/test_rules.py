@@ -6,12 +6,19 @@ Tests different customer contexts to verify rules are correctly evaluated
 
 import sys
 import os
+import asyncio
+import json
+import random
+import tempfile
 from pathlib import Path
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from rules_engine import load_rules_engine
+from rules_engine import load_rules_engine, RulesEngine
+from agents.router import _classify_by_keywords
+from agents.streaming import PartialJSONFields
+from agents.batcher import MicroBatcher
 
 
 def test_scenario(name, context, expected_decision=None, expected_stop_allowed=None):
@@ -56,6 +63,303 @@ def test_scenario(name, context, expected_decision=None, expected_stop_allowed=N
         return False
 
 
+def test_keywords(name, messages, expected_process=None, expected_data=None):
+    """Test the router keyword fast path (None = left to Gemini) and print results"""
+    print(f"\n{'='*60}")
+    print(f"Keywords: {name}")
+    print(f"{'='*60}")
+    print(f"Messages: {messages}")
+    
+    try:
+        detection = _classify_by_keywords(messages)
+        process = detection["process"] if detection else None
+        print(f"\n   Process: {process}")
+        if detection:
+            print(f"   Extracted Data: {detection.get('extracted_data')}")
+        
+        passed = True
+        if process != expected_process:
+            print(f"\n❌ FAILED: Expected process {expected_process}, got {process}")
+            passed = False
+        
+        if expected_data:
+            extracted = detection.get("extracted_data", {}) if detection else {}
+            for key, value in expected_data.items():
+                if extracted.get(key) != value:
+                    print(f"\n❌ FAILED: Expected {key} {value!r}, got {extracted.get(key)!r}")
+                    passed = False
+        
+        if passed:
+            print(f"\n✅ PASSED")
+        
+        return passed
+        
+    except Exception as e:
+        print(f"\n❌ ERROR: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def reference_evaluate(rules_data, context):
+    """Unoptimized evaluation (every rule, every condition) RulesEngine must match"""
+    for field in rules_data.get("required_fields", []):
+        value = context.get(field)
+        if value is None or value == "" or value == "desconocido" or value == "null":
+            behavior = rules_data.get("missing_info_behavior", {})
+            return {
+                "status": "NEED_INFO",
+                "missing_field": field,
+                "behavior": behavior.get("status", "NEED_INFO"),
+                "question_data": behavior.get("questions", {}).get(field)
+            }
+    
+    def condition_matches(condition, value):
+        if value is None:
+            return False
+        if not isinstance(condition, dict):
+            return condition == value
+        if "min" in condition and value < condition["min"]:
+            return False
+        if "max" in condition and value > condition["max"]:
+            return False
+        return True
+    
+    rules = sorted(rules_data.get("rules", []), key=lambda r: r.get("priority", 0), reverse=True)
+    matched = [
+        rule for rule in rules
+        if all(condition_matches(c, context.get(f)) for f, c in rule.get("when", {}).items())
+    ]
+    if not matched:
+        return {
+            "status": "RECOMMENDATION",
+            "decision": "no_match",
+            "stop_allowed": None,
+            "allowed_actions": [],
+            "reason": "no_rules_matched"
+        }
+    then_clause = matched[0].get("then", {})
+    decision = {
+        "status": "RECOMMENDATION",
+        "decision": then_clause.get("decision", "unknown"),
+        "stop_allowed": then_clause.get("stop_allowed"),
+        "allowed_actions": then_clause.get("allowed_actions", []),
+        "reason": then_clause.get("reason", "rule_" + matched[0].get("id", "unknown"))
+    }
+    for rule in matched:
+        if "allow_stop_0euros" in rule.get("then", {}):
+            decision["allow_stop_0euros"] = rule["then"]["allow_stop_0euros"]
+    return decision
+
+
+# Values drawn for random contexts and rules (mixed types on purpose)
+RANDOM_VALUES = [None, "", "null", True, False, 0, 1, 2, 3.5, 4, 5, "Ahorro", "Planocho", "x", [1]]
+
+
+def random_rules(rng, count):
+    """Synthetic rule set over a few fields, large enough for the prefilter"""
+    fields = ["plan", "motivo", "canal", "scoring", "stops"]
+    rules = []
+    for i in range(count):
+        when = {}
+        for field in rng.sample(fields, rng.randint(0, 3)):
+            kind = rng.random()
+            if kind < 0.6:
+                when[field] = rng.choice(["Ahorro", "Planocho", "Chat", 0, 1, 4, True, None])
+            elif kind < 0.8:
+                when[field] = {"min": rng.choice([0, 2, 4])}
+            elif kind < 0.95:
+                when[field] = {"max": rng.choice([1, 3, 5])}
+            else:
+                when[field] = {"min": 1, "max": 4}
+        then = {"decision": f"d{i}", "stop_allowed": rng.choice([True, False, None])}
+        if rng.random() < 0.2:
+            then["allow_stop_0euros"] = rng.choice([True, False])
+        rules.append({"id": f"r{i}", "priority": rng.randint(0, 10), "when": when, "then": then})
+    return {"required_fields": ["canal"], "rules": rules}
+
+
+def evaluation_outcome(evaluate, context):
+    """Result of evaluate(context), or "TypeError" if it raised one"""
+    try:
+        return evaluate(context)
+    except TypeError:
+        return "TypeError"
+
+
+def test_equivalence(name, rules_data, iterations=3000, seed=1):
+    """Compare RulesEngine (prefilter on and off) with reference_evaluate on random contexts"""
+    print(f"\n{'='*60}")
+    print(f"Equivalence: {name}")
+    print(f"{'='*60}")
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            rules_path = Path(tmp) / "rules.json"
+            rules_path.write_text(json.dumps(rules_data), encoding="utf-8")
+            prefiltered = RulesEngine(str(rules_path), prefilter_min_rules=0)
+            scanned = RulesEngine(str(rules_path), prefilter_min_rules=sys.maxsize)
+        
+        fields = {"plan", "motivo", "canal", "scoring", "stops"}
+        fields.update(rules_data.get("required_fields", []))
+        for rule in rules_data.get("rules", []):
+            fields.update(rule.get("when", {}))
+        
+        rng = random.Random(seed)
+        lenient = 0
+        for _ in range(iterations):
+            context = {f: rng.choice(RANDOM_VALUES) for f in sorted(fields) if rng.random() < 0.8}
+            expected = evaluation_outcome(lambda ctx: reference_evaluate(rules_data, ctx), context)
+            prefilter_result = evaluation_outcome(prefiltered.evaluate, context)
+            scan_result = evaluation_outcome(scanned.evaluate, context)
+            if expected == "TypeError":
+                # The reference compares every condition; the engine may stop
+                # before the incomparable one, but both paths must agree
+                lenient += 1
+                expected = scan_result
+            for label, result in (("prefilter", prefilter_result), ("scan", scan_result)):
+                if result != expected:
+                    print(f"\n❌ FAILED ({label}): {context}")
+                    print(f"   Expected: {expected}")
+                    print(f"   Got: {result}")
+                    return False
+        
+        print(f"\n   Contexts: {iterations} ({lenient} raising TypeError in the reference)")
+        print(f"\n✅ PASSED")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ ERROR: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_partial_json(name, chunks, fields, expected):
+    """Feed streamed chunks to PartialJSONFields and compare the accumulated deltas"""
+    print(f"\n{'='*60}")
+    print(f"Partial JSON: {name}")
+    print(f"{'='*60}")
+    print(f"Chunks: {chunks}")
+    
+    try:
+        tracker = PartialJSONFields(fields)
+        streamed = {}
+        for chunk in chunks:
+            for field, delta in tracker.feed(chunk).items():
+                streamed[field] = streamed.get(field, "") + delta
+        print(f"\n   Streamed: {streamed}")
+        
+        if streamed != expected:
+            print(f"\n❌ FAILED: Expected {expected}")
+            return False
+        
+        print(f"\n✅ PASSED")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ ERROR: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+def test_batcher(name, scenario, expected):
+    """Run an async MicroBatcher scenario and compare what it returns"""
+    print(f"\n{'='*60}")
+    print(f"MicroBatcher: {name}")
+    print(f"{'='*60}")
+    
+    try:
+        result = asyncio.run(scenario())
+        print(f"\n   Result: {result}")
+        
+        if result != expected:
+            print(f"\n❌ FAILED: Expected {expected}")
+            return False
+        
+        print(f"\n✅ PASSED")
+        return True
+        
+    except Exception as e:
+        print(f"\n❌ ERROR: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
+
+async def batcher_splits_batches():
+    """Results come back in order and batches respect max_size"""
+    sizes = []
+    
+    async def handler(items):
+        sizes.append(len(items))
+        return [item * 10 for item in items]
+    
+    batcher = MicroBatcher(handler, max_size=4, max_wait=0.05)
+    batcher.start()
+    results = await asyncio.gather(*(batcher.submit(i) for i in range(6)))
+    await batcher.stop()
+    return results, sizes
+
+
+async def batcher_handler_error():
+    """A failing handler fails every request of its batch"""
+    async def handler(items):
+        raise ValueError("boom")
+    
+    batcher = MicroBatcher(handler, max_wait=0.01)
+    batcher.start()
+    results = await asyncio.gather(batcher.submit(1), batcher.submit(2), return_exceptions=True)
+    await batcher.stop()
+    return [type(r).__name__ for r in results]
+
+
+async def batcher_short_results():
+    """Requests without a result are cancelled instead of waiting forever"""
+    async def handler(items):
+        return items[:1]
+    
+    batcher = MicroBatcher(handler, max_wait=0.01)
+    batcher.start()
+    results = await asyncio.gather(batcher.submit("a"), batcher.submit("b"), return_exceptions=True)
+    await batcher.stop()
+    return [r if isinstance(r, str) else type(r).__name__ for r in results]
+
+
+async def batcher_stop_drains():
+    """stop() lets the batch in flight finish"""
+    async def handler(items):
+        await asyncio.sleep(0.05)
+        return items
+    
+    batcher = MicroBatcher(handler, max_wait=0.01)
+    batcher.start()
+    pending = asyncio.ensure_future(batcher.submit("in-flight"))
+    await asyncio.sleep(0.02)
+    await batcher.stop()
+    return await pending
+
+
+async def batcher_stop_while_collecting():
+    """stop() cancels the batch still being collected; later submits fail"""
+    async def handler(items):
+        return items
+    
+    batcher = MicroBatcher(handler, max_wait=1.0)
+    batcher.start()
+    pending = asyncio.ensure_future(batcher.submit("collecting"))
+    await asyncio.sleep(0.02)
+    await batcher.stop()
+    outcomes = []
+    for waiter in (asyncio.wait_for(pending, 1.0), asyncio.wait_for(batcher.submit("late"), 1.0)):
+        try:
+            outcomes.append(await waiter)
+        except BaseException as e:
+            outcomes.append(type(e).__name__)
+    return outcomes
+
+
 def main():
     print("\n" + "="*60)
     print("RULES ENGINE TESTS")
@@ -137,6 +441,140 @@ def main():
         expected_stop_allowed=False
     ))
     
+    # Router keyword fast path
+    results.append(test_keywords(
+        "Saludo - Social",
+        ["Hola", "Buenas tardes"],
+        expected_process="SOCIAL"
+    ))
+    
+    results.append(test_keywords(
+        "Vacaciones - Stop reparto",
+        ["Me voy de vacaciones, quiero parar el pedido"],
+        expected_process="STOP_REPARTO",
+        expected_data={"motivo": "ausencia_vacaciones"}
+    ))
+    
+    results.append(test_keywords(
+        "Sin cápsulas - Aviso urgente",
+        ["Me he quedado sin cápsulas, ¿podéis traerme?"],
+        expected_process="AVISO_URGENTE",
+        expected_data={"producto": "cafe"}
+    ))
+    
+    results.append(test_keywords(
+        "Agua urgente con cantidad - Aviso urgente",
+        ["Necesito agua urgente, 2 botellas"],
+        expected_process="AVISO_URGENTE",
+        expected_data={"producto": "agua", "cantidad": "2 botellas"}
+    ))
+    
+    results.append(test_keywords(
+        "Stop sin motivo - Gemini",
+        ["Quiero parar el pedido"]
+    ))
+    
+    results.append(test_keywords(
+        "Quedarse sin algo que no es producto - Gemini",
+        ["Me he quedado sin saber cuándo llega mi pedido"]
+    ))
+    
+    results.append(test_keywords(
+        "Sin batería - Gemini",
+        ["Me he quedado sin batería, te llamo luego"]
+    ))
+    
+    results.append(test_keywords(
+        "Urgente sin producto - Gemini",
+        ["¿Es urgente que firme el albarán?"]
+    ))
+    
+    results.append(test_keywords(
+        "Negación - Gemini",
+        ["No me he quedado sin agua, era broma"]
+    ))
+    
+    results.append(test_keywords(
+        "Preparar contiene parar - Gemini",
+        ["Estoy fuera de casa, ¿me podéis preparar el pedido para el lunes?"]
+    ))
+    
+    results.append(test_keywords(
+        "Vacaciones sin intención de stop - Gemini",
+        ["Me voy de vacaciones mañana, ¿podéis traerme 2 botellas antes?"]
+    ))
+    
+    results.append(test_keywords(
+        "Pregunta hipotética - Gemini",
+        ["Vale, gracias. ¿Y si estoy sin agua?"]
+    ))
+    
+    # Optimized rules engine vs reference evaluation
+    for process in ("STOP_REPARTO", "AVISO_URGENTE"):
+        rules_file = Path(__file__).parent / process.lower() / f"rules_{process.lower()}.json"
+        results.append(test_equivalence(
+            f"Reglas {process}",
+            json.loads(rules_file.read_text(encoding="utf-8"))
+        ))
+    
+    results.append(test_equivalence(
+        "Reglas sintéticas (64)",
+        random_rules(random.Random(7), 64)
+    ))
+    
+    # Streamed JSON fields
+    results.append(test_partial_json(
+        "Campo en varios trozos",
+        ['{"titulo": "Ho', 'la", "speech_sugerido": "Buen', 'os días"}'],
+        ["titulo", "speech_sugerido"],
+        {"titulo": "Hola", "speech_sugerido": "Buenos días"}
+    ))
+    
+    results.append(test_partial_json(
+        "Escape cortado entre trozos",
+        ['{"speech_sugerido": "caf\\u00', 'e9 \\"ya\\""}'],
+        ["speech_sugerido"],
+        {"speech_sugerido": 'café "ya"'}
+    ))
+    
+    results.append(test_partial_json(
+        "Campo no vigilado",
+        ['{"objetivo": "FCR", "titulo": "T"}'],
+        ["speech_sugerido"],
+        {}
+    ))
+    
+    # Micro-batching
+    results.append(test_batcher(
+        "Orden y tamaño de lote",
+        batcher_splits_batches,
+        ([0, 10, 20, 30, 40, 50], [4, 2])
+    ))
+    
+    results.append(test_batcher(
+        "Error del handler",
+        batcher_handler_error,
+        ["ValueError", "ValueError"]
+    ))
+    
+    results.append(test_batcher(
+        "Lista de resultados corta",
+        batcher_short_results,
+        ["a", "CancelledError"]
+    ))
+    
+    results.append(test_batcher(
+        "stop() drena el lote en curso",
+        batcher_stop_drains,
+        "in-flight"
+    ))
+    
+    results.append(test_batcher(
+        "stop() durante la espera del lote",
+        batcher_stop_while_collecting,
+        ["CancelledError", "RuntimeError"]
+    ))
+    
     # Summary
     print("\n" + "="*60)
     print("TEST SUMMARY")